@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import hashlib
+import io
+import os
+import pickle
+import shelve
+import threading
+import time
 import chess
 import chess.pgn
+import chess.polyglot
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 import sys
 
@@ -18,161 +30,402 @@ def setup_logging(verbose):
     else:
         logging.basicConfig(level=logging.WARNING)
 
+##############################
+# Helper: Zobrist Position Keys
+##############################
+_ZOBRIST_ARRAY = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_ZOBRIST_HASHER = chess.polyglot.ZobristHasher(_ZOBRIST_ARRAY)
+
+def zobrist_piece(piece_type, color, square):
+    """Zobrist term for one piece on one square (polyglot layout)."""
+    return _ZOBRIST_ARRAY[64 * ((piece_type - 1) * 2 + color) + square]
+
+# Castling term per (castling rights, kings): a handful of distinct values per game, so it is
+# looked up instead of re-testing all four castling rights on every move.
+_CASTLING_TERMS = {}
+
+def zobrist_state(board):
+    """Zobrist terms for castling rights, en passant file and side to move."""
+    state = 0
+    castling_rights = board.clean_castling_rights()
+    if castling_rights:
+        castling_key = (castling_rights, board.kings)
+        castling_term = _CASTLING_TERMS.get(castling_key)
+        if castling_term is None:
+            castling_term = _CASTLING_TERMS[castling_key] = _ZOBRIST_HASHER.hash_castling(board)
+        state = castling_term
+    if board.ep_square is not None:
+        state ^= _ZOBRIST_HASHER.hash_ep_square(board)
+    if board.turn == chess.WHITE:
+        state ^= _ZOBRIST_ARRAY[780]
+    return state
+
+def zobrist_before_push(board, move, key):
+    """
+    Return key (the Zobrist key of board) with the terms for the pieces move changes
+    XORed out/in, and the pre-move castling, en passant and turn terms XORed out.
+    XORing in zobrist_state(board) once the move is pushed gives the new position's key.
+    """
+    if not move:
+        return key ^ zobrist_state(board)
+    color = board.turn
+    piece_type = board.piece_type_at(move.from_square)
+    key ^= zobrist_state(board) ^ zobrist_piece(piece_type, color, move.from_square)
+    if piece_type == chess.KING and board.is_castling(move):
+        back_rank = 0 if color == chess.WHITE else 56
+        kingside = board.is_kingside_castling(move)
+        if board.rooks & board.occupied_co[color] & chess.BB_SQUARES[move.to_square]:
+            rook_from = move.to_square  # king-takes-rook encoding (Chess960)
+        else:
+            rook_from = back_rank + 7 if kingside else back_rank
+        # The king and rook land on the g/f (kingside) or c/d (queenside) files in either variant.
+        king_to, rook_to = (back_rank + 6, back_rank + 5) if kingside else (back_rank + 2, back_rank + 3)
+        key ^= (zobrist_piece(chess.KING, color, king_to) ^
+                zobrist_piece(chess.ROOK, color, rook_from) ^ zobrist_piece(chess.ROOK, color, rook_to))
+    else:
+        captured_type = board.piece_type_at(move.to_square)
+        if captured_type:
+            key ^= zobrist_piece(captured_type, not color, move.to_square)
+        elif piece_type == chess.PAWN and board.is_en_passant(move):
+            captured_square = move.to_square - 8 if color == chess.WHITE else move.to_square + 8
+            key ^= zobrist_piece(chess.PAWN, not color, captured_square)
+        key ^= zobrist_piece(move.promotion or piece_type, color, move.to_square)
+    return key
+
+def push_with_key(board, move, key):
+    """
+    Push move onto board and return the new position's Zobrist key, updated from key
+    (the key before the move) by XORing out/in only the pieces and state the move changes.
+    Equal to chess.polyglot.zobrist_hash(board) after the push.
+    """
+    key = zobrist_before_push(board, move, key)
+    board.push(move)
+    return key ^ zobrist_state(board)
+
 ##############################
 # PHASE 1: Build Repertoire Trees (with variations)
 ##############################
+SIDE_NAMES = {chess.WHITE: "White", chess.BLACK: "Black"}
+
+# One shared chess.Move object per distinct move, so trees built from many games
+# do not keep a separate copy of e.g. e2e4 for every position it is played from.
+_MOVE_POOL = {}
+
+def intern_move(move):
+    """Return the pooled chess.Move equal to move (adding move to the pool if new)."""
+    return _MOVE_POOL.setdefault(move, move)
+
+class RepertoireNode:
+    """
+    One position of a RepertoireTree: its first recorded move (the one the simulation plays)
+    and, once more moves are recorded there, the others in the order they were recorded.
+    Child positions are not stored; pushing a move gives its position and key.
+    """
+    __slots__ = ('first', 'others')
+
+    def __init__(self, move):
+        self.first = move
+        self.others = None
+
 class RepertoireTree:
+    __slots__ = ('tree',)
+
     def __init__(self):
-        # tree maps a FEN string to a dictionary of moves (in UCI) and resulting child FENs.
+        # tree maps a position's Zobrist key to its RepertoireNode.
         self.tree = {}
     
-    def insert(self, key_fen, move_uci, child_fen):
-        if key_fen not in self.tree:
-            self.tree[key_fen] = {}
-        if move_uci not in self.tree[key_fen]:
-            self.tree[key_fen][move_uci] = child_fen
-
-def process_white_node(node, board, tree):
-    """Recursively traverse a PGN node and record White's moves."""
-    for variation in node.variations:
-        move = variation.move
-        if board.turn == chess.WHITE:
-            key_fen = board.fen()
-            move_uci = move.uci()
-            new_board = board.copy()
-            try:
-                new_board.push(move)
-            except Exception as e:
-                logging.error("Error pushing white move %s at FEN %s: %s", move_uci, board.fen(), e)
-                continue
-            child_fen = new_board.fen()
-            tree.insert(key_fen, move_uci, child_fen)
-            logging.debug("White tree: At FEN '%s', added move '%s' -> '%s'", key_fen, move_uci, child_fen)
-        board.push(move)
-        process_white_node(variation, board, tree)
-        board.pop()
+    def insert(self, key, move):
+        """Record move at the position with this Zobrist key; return False if it was already present."""
+        node = self.tree.get(key)
+        if node is None:
+            self.tree[key] = RepertoireNode(intern_move(move))
+            return True
+        if move == node.first:
+            return False
+        if node.others is None:
+            node.others = [intern_move(move)]
+        elif move in node.others:
+            return False
+        else:
+            node.others.append(intern_move(move))
+        return True
 
-def build_white_tree(filename):
-    tree = RepertoireTree()
-    game_count = 0
-    with open(filename, 'r', encoding='utf-8', errors='replace') as pgn_file:
-        while True:
-            game = chess.pgn.read_game(pgn_file)
-            if game is None:
-                break
-            game_count += 1
-            board = chess.Board()
-            process_white_node(game, board, tree)
-    logging.debug("White repertoire: Loaded %d games with %d unique positions.", game_count, len(tree.tree))
-    return tree
+class TreeBuilder(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records one side's moves (with variations) into a RepertoireTree
+    while the game is parsed, so no Game/ChildNode tree is built.
+    """
+    def __init__(self, tree, color):
+        self.tree = tree
+        self.color = color
+        self.side = SIDE_NAMES[color]
 
-def process_black_node(node, board, tree):
+    def begin_game(self):
+        # One entry per open line, mirroring the parser's board stack:
+        # [Zobrist keys of the line's positions, recorded edges, finished variations, start ply].
+        self.lines = []
+        self.pending = None
+
+    def visit_board(self, board):
+        # Called for the initial position and after every move the parser pushes.
+        if not self.lines:
+            self.lines.append([[chess.polyglot.zobrist_hash(board)], [], [], 0])
+            return
+        if self.pending is None:
+            return
+        key, move, partial_key = self.pending
+        self.pending = None
+        keys, edges = self.lines[-1][0], self.lines[-1][1]
+        child_key = partial_key ^ zobrist_state(board)
+        keys.append(child_key)
+        if board.turn != self.color:
+            edges.append((key, move, child_key))
+
+    def visit_move(self, board, move):
+        # parse_san only yields legal moves, so the move can be recorded as is.
+        key = self.lines[-1][0][-1]
+        self.pending = (key, move, zobrist_before_push(board, move, key))
+
+    def begin_variation(self):
+        # The parser starts a variation from the position before the line's last move.
+        keys = self.lines[-1][0]
+        self.lines.append([keys[:-1], [], [], len(keys) - 1])
+
+    def end_variation(self):
+        if len(self.lines) > 1:
+            line = self.lines.pop()
+            self.lines[-1][2].append((line[3], self.ordered_edges(line)))
+
+    def ordered_edges(self, line):
+        # The file lists a variation right after the move it replaces, but the tree is
+        # filled depth-first (the move's whole continuation before its alternatives), as
+        # walking the parsed game would: later plies' variations first, in file order per ply.
+        edges = line[1]
+        for ply, variation_edges in sorted(line[2], key=lambda variation: -variation[0]):
+            edges.extend(variation_edges)
+        return edges
+
+    def end_game(self):
+        if not self.lines:
+            return
+        for key, move, child_key in self.ordered_edges(self.lines[0]):
+            # Lines shared with earlier games (or transpositions) only re-find known edges.
+            if self.tree.insert(key, move):
+                logging.debug("%s tree: At key %016x, added move '%s' -> %016x", self.side, key, move, child_key)
+
+    def handle_error(self, error):
+        # The parser skips the rest of the variation; keep what was recorded so far.
+        logging.error("Error parsing %s repertoire PGN: %s", self.side.lower(), error)
+
+    def result(self):
+        return self.tree
+
+def open_pgn(filename):
     """
-    Recursively traverse a PGN game node (and its variations) for Black's moves.
-    Before pushing a move, check that it is legal. If not, log and skip that variation.
+    Open a PGN file for chess.pgn.read_game: a buffered binary read decoded as UTF-8
+    (undecodable bytes replaced), without universal-newline translation (the PGN
+    parser handles CRLF itself).
     """
-    for variation in node.variations:
-        move = variation.move
-        if board.turn == chess.BLACK:
-            key_fen = board.fen()
-            move_uci = move.uci()
-            new_board = board.copy()
-            if move in new_board.legal_moves:
-                try:
-                    new_board.push(move)
-                except Exception as e:
-                    logging.error("Error pushing black move %s at FEN %s: %s", move_uci, board.fen(), e)
-                    continue
-                child_fen = new_board.fen()
-                tree.insert(key_fen, move_uci, child_fen)
-                logging.debug("Black tree: At FEN '%s', added move '%s' -> '%s'", key_fen, move_uci, child_fen)
-            else:
-                logging.debug("Skipping illegal black move %s at FEN %s", move_uci, board.fen())
-                continue
-        try:
-            board.push(move)
-        except AssertionError as e:
-            logging.debug("Skipping illegal move %s at FEN %s: %s", move.uci(), board.fen(), e)
-            continue
-        process_black_node(variation, board, tree)
-        board.pop()
+    return io.TextIOWrapper(open(filename, 'rb'), encoding='utf-8', errors='replace', newline='\n')
 
-def build_black_tree(filename):
+def build_tree(filename, color):
     tree = RepertoireTree()
+    builder = TreeBuilder(tree, color)
     game_count = 0
-    with open(filename, 'r', encoding='utf-8', errors='replace') as pgn_file:
-        while True:
-            game = chess.pgn.read_game(pgn_file)
-            if game is None:
-                break
+    with open_pgn(filename) as pgn_file:
+        while chess.pgn.read_game(pgn_file, Visitor=lambda: builder) is not None:
             game_count += 1
-            board = chess.Board()
-            process_black_node(game, board, tree)
-    logging.debug("Black repertoire: Loaded %d games with %d unique positions.", game_count, len(tree.tree))
+    logging.debug("%s repertoire: Loaded %d games with %d unique positions.",
+                  builder.side, game_count, len(tree.tree))
+    return tree
+
+def build_white_tree(filename):
+    return build_tree(filename, chess.WHITE)
+
+def build_black_tree(filename):
+    return build_tree(filename, chess.BLACK)
+
+# Built trees are pickled under ~/.cache/opening_arena, one file per
+# (script, builder, PGN path, mtime, size), so unchanged repertoires skip the PGN parser.
+_TREE_CACHE_DIR = os.path.expanduser("~/.cache/opening_arena")
+
+def tree_cache_path(builder, filename):
+    """Return the pickle path for builder(filename), keyed by the PGN file's path, mtime and size."""
+    stat = os.stat(filename)
+    # The script's own mtime is part of the key so an edited builder never sees stale pickles,
+    # and the module name, since trees pickled by the script reference __main__ classes.
+    key = (os.path.abspath(__file__), os.stat(__file__).st_mtime_ns, __name__, builder.__name__,
+           os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(_TREE_CACHE_DIR, f"tree_{digest}.pkl")
+
+def load_cached_tree(pickle_path):
+    """Return the tree pickled at pickle_path by a previous run, or None if it is missing or unreadable."""
+    try:
+        with open(pickle_path, 'rb') as pickle_file:
+            return pickle.load(pickle_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # The cache is best-effort: a corrupt or incompatible pickle just means a rebuild.
+        logging.debug("Ignoring tree cache %s: %s", pickle_path, e)
+        return None
+
+def build_and_cache_tree(builder, filename, pickle_path):
+    tree = builder(filename)
+    try:
+        os.makedirs(_TREE_CACHE_DIR, exist_ok=True)
+        with open(pickle_path, 'wb') as pickle_file:
+            pickle.dump(tree, pickle_file, pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logging.debug("Could not write tree cache %s: %s", pickle_path, e)
     return tree
 
+def build_trees(white_filename, black_filename):
+    """
+    Return the white and black repertoire trees, loading each from the tree cache while its
+    PGN file is unchanged. If both must be built, the two independent files are parsed at the
+    same time in two worker processes (PGN parsing holds the GIL), except on a single CPU or
+    with debug logging on (keeping debug.log in order).
+    """
+    jobs = [("white", build_white_tree, white_filename), ("black", build_black_tree, black_filename)]
+    pickle_paths = [tree_cache_path(builder, filename) for _, builder, filename in jobs]
+    trees = [load_cached_tree(pickle_path) for pickle_path in pickle_paths]
+    if (trees == [None, None] and (os.cpu_count() or 1) >= 2
+            and not logging.getLogger().isEnabledFor(logging.DEBUG)):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(build_and_cache_tree, builder, filename, pickle_path)
+                       for (_, builder, filename), pickle_path in zip(jobs, pickle_paths)]
+            return futures[0].result(), futures[1].result()
+    for i, ((color_name, builder, filename), pickle_path) in enumerate(zip(jobs, pickle_paths)):
+        if trees[i] is None:
+            logging.debug("Building %s repertoire tree...", color_name)
+            trees[i] = build_and_cache_tree(builder, filename, pickle_path)
+        else:
+            logging.debug("Loaded %s repertoire tree from %s (%d unique positions).",
+                          color_name, pickle_path, len(trees[i].tree))
+    return trees[0], trees[1]
+
 ##############################
 # PHASE 2: Simulate the Opening
 ##############################
 def format_san_sequence(san_seq):
-    moves = []
-    move_num = 1
-    i = 0
-    while i < len(san_seq):
-        if i + 1 < len(san_seq):
-            moves.append(f"{move_num}.{san_seq[i]} {san_seq[i+1]}")
-            i += 2
-        else:
-            moves.append(f"{move_num}.{san_seq[i]}")
-            i += 1
-        move_num += 1
+    pairs = zip(san_seq[0::2], san_seq[1::2])
+    moves = [f"{move_num}.{white} {black}" for move_num, (white, black) in enumerate(pairs, 1)]
+    if len(san_seq) % 2:
+        moves.append(f"{len(san_seq) // 2 + 1}.{san_seq[-1]}")
     return " ".join(moves)
 
 def simulate_game(white_tree, black_tree):
     """
     Simulate a game using the repertoire trees.
-    If it's White's turn, look up board.fen() in white_tree; if found, play the first candidate move.
-    Similarly for Black.
+    Look up the position's Zobrist key in the tree of the side to move; if found, play its
+    first candidate move, otherwise that side is out-of-book. Keys ignore the move counters,
+    so a line that returns to an earlier position would cycle forever; the side to move at
+    a repeated position is treated as out-of-book.
     """
     board = chess.Board()
     san_sequence = []
+    key = chess.polyglot.zobrist_hash(board)
+    seen = set()
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)  # checked once, not per ply
+    # Position dicts bound once, so each ply is a single dict lookup per side.
+    books = {chess.WHITE: white_tree.tree, chess.BLACK: black_tree.tree}
     while True:
-        current_fen = board.fen()
-        if board.turn == chess.WHITE:
-            if current_fen in white_tree.tree and white_tree.tree[current_fen]:
-                candidate = list(white_tree.tree[current_fen].keys())[0]
-                move = chess.Move.from_uci(candidate)
-                if move not in board.legal_moves:
-                    logging.debug("White candidate %s illegal at FEN: %s", candidate, current_fen)
-                    break
-                san = board.san(move)
-                san_sequence.append(san)
-                board.push(move)
-                logging.debug("White plays %s (%s); New FEN: %s", candidate, san, board.fen())
-            else:
-                logging.debug("White out-of-book at FEN: %s", current_fen)
-                break
-        else:
-            if current_fen in black_tree.tree and black_tree.tree[current_fen]:
-                candidate = list(black_tree.tree[current_fen].keys())[0]
-                move = chess.Move.from_uci(candidate)
-                if move not in board.legal_moves:
-                    logging.debug("Black candidate %s illegal at FEN: %s", candidate, current_fen)
-                    break
-                san = board.san(move)
-                san_sequence.append(san)
-                board.push(move)
-                logging.debug("Black plays %s (%s); New FEN: %s", candidate, san, board.fen())
-            else:
-                logging.debug("Black out-of-book at FEN: %s", current_fen)
-                break
-    logging.debug("Final move sequence: %s", format_san_sequence(san_sequence))
+        if key in seen:
+            if debug:
+                logging.debug("%s out-of-book at repeated key: %016x", SIDE_NAMES[board.turn], key)
+            break
+        seen.add(key)
+        node = books[board.turn].get(key)
+        if node is None:
+            if debug:
+                logging.debug("%s out-of-book at key: %016x", SIDE_NAMES[board.turn], key)
+            break
+        move = node.first
+        if not board.is_legal(move):
+            if debug:
+                logging.debug("%s candidate %s illegal at key: %016x", SIDE_NAMES[board.turn], move, key)
+            break
+        san = board.san(move)
+        san_sequence.append(san)
+        key = push_with_key(board, move, key)
+        if debug:
+            logging.debug("%s plays %s (%s); New key: %016x", SIDE_NAMES[not board.turn], move, san, key)
+    if debug:
+        logging.debug("Final move sequence: %s", format_san_sequence(san_sequence))
     return board, san_sequence
 
 ##############################
 # PHASE 3: Lichess Explorer API Lookup & Results Display
 ##############################
-def query_lichess(fen, ratings):
+# One pooled keep-alive session for all Explorer requests, retrying transient failures.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+
+# On-disk cache of Explorer responses, keyed by (position, ratings). Each entry is stored
+# with the time it was fetched and expires after _CACHE_TTL seconds, since the Explorer's
+# statistics grow as games are played. (A separate file from the working scripts' cache,
+# whose entries are stored without a timestamp.)
+_CACHE_PATH = os.path.expanduser("~/.cache/opening_arena/explorer_timed")
+_CACHE_TTL = 86400
+_CACHE_LOCK = threading.Lock()
+
+def explorer_cache_key(fen, ratings):
+    """
+    Build the cache key for a query: the FEN without its halfmove/fullmove counters
+    (piece placement, turn, castling, en passant) plus the ratings string.
+    """
+    return " ".join(fen.split()[:4]) + "|" + ratings.replace(" ", "")
+
+# The cache is best-effort: if it cannot be opened (e.g. an unwritable home directory),
+# lookups miss and stores are dropped, so queries go straight to the Explorer.
+def cache_get(key):
+    """Return the cached response for key, or None if it is missing or older than _CACHE_TTL."""
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                entry = cache.get(key)
+        except Exception:
+            return None
+    if entry is None:
+        return None
+    fetched_at, data = entry
+    if time.time() - fetched_at > _CACHE_TTL:
+        return None
+    return data
+
+def cache_set(key, data):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                cache[key] = (time.time(), data)
+        except Exception:
+            pass
+
+@functools.lru_cache(maxsize=4096)
+def query_lichess(fen, ratings, use_cache=True):
+    """
+    Query the Lichess Explorer API for fen, answering from the on-disk cache when possible
+    (use_cache=False bypasses it). Returns (white_wins, draws, black_wins, total, api_data).
+    """
+    key = explorer_cache_key(fen, ratings)
+    data = cache_get(key) if use_cache else None
+    if data is None:
+        data = fetch_explorer_data(fen, ratings)
+        if use_cache:
+            cache_set(key, data)
+    white_wins = data.get("white", 0)
+    draws = data.get("draws", 0)
+    black_wins = data.get("black", 0)
+    total = white_wins + draws + black_wins
+    return white_wins, draws, black_wins, total, data
+
+def fetch_explorer_data(fen, ratings):
     params = {
         "variant": "standard",
         "speeds": "blitz,rapid,classical",
@@ -180,14 +433,9 @@ def query_lichess(fen, ratings):
         "fen": fen
     }
     api_url = "https://explorer.lichess.ovh/lichess"
-    response = requests.get(api_url, params=params)
+    response = _SESSION.get(api_url, params=params, timeout=10)
     response.raise_for_status()
-    data = response.json()
-    white_wins = data.get("white", 0)
-    draws = data.get("draws", 0)
-    black_wins = data.get("black", 0)
-    total = white_wins + draws + black_wins
-    return white_wins, draws, black_wins, total, data
+    return response.json()
 
 def print_moves_table(moves, current_move_number, is_white_turn):
     header = f"{'Move':<12}{'White':>10}{'Draws':>10}{'Black':>10}{'Total':>10} {'W%':>8} {'D%':>8} {'B%':>8}"
@@ -214,15 +462,16 @@ def print_moves_table(moves, current_move_number, is_white_turn):
             wp = dp = bp = 0
         print(f"{move_str:<12}{w:10d}{d:10d}{b:10d}{tot:10d} {wp:7.1f}% {dp:7.1f}% {bp:7.1f}%")
 
-def print_results(final_fen, moves_played, candidate_moves, board, args):
-    # Print only once—the file names are printed here.
-    print("White:", args.white)
-    print("Black:", args.black)
+def print_results(final_fen, moves_played_str, board, white_path, black_path, ratings, use_cache=True):
+    # Print only once—the file names are printed here. moves_played_str is already formatted
+    # (empty if no moves were played).
+    print("White:", white_path)
+    print("Black:", black_path)
     print("Final FEN:", final_fen)
     print("\nMoves played to reach this position:")
-    if moves_played:
-        print(format_san_sequence(moves_played))
-        logging.debug("Moves played: %s", format_san_sequence(moves_played))
+    if moves_played_str:
+        print(moves_played_str)
+        logging.debug("Moves played: %s", moves_played_str)
     else:
         print("(No moves played)")
         logging.debug("No moves were played.")
@@ -239,7 +488,8 @@ def print_results(final_fen, moves_played, candidate_moves, board, args):
         print("\n(Mate reached; no candidate moves table available.)")
     else:
         try:
-            white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, args.elo.replace(" ", ""))
+            white_wins, draws, black_wins, total, api_data = query_lichess(
+                final_fen, ratings, use_cache=use_cache)
         except Exception as e:
             logging.debug("API request failed: %s", e)
             print("API request failed:", e)
@@ -277,70 +527,25 @@ def main():
                         help="Comma separated ELO brackets (e.g. 1200,1400,1600,1800)")
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Enable verbose debug logging to debug.log")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always query the Lichess Explorer API, bypassing the on-disk cache")
     args = parser.parse_args()
 
     setup_logging(args.verbose)
+    # The Explorer takes the brackets without spaces; normalise them once.
+    ratings = args.elo.replace(" ", "")
 
     # Phase 1: Build the repertoire trees.
-    logging.debug("Building white repertoire tree...")
-    white_tree = build_white_tree(args.white)
-    logging.debug("Building black repertoire tree...")
-    black_tree = build_black_tree(args.black)
+    white_tree, black_tree = build_trees(args.white, args.black)
 
     # Phase 2: Simulate the game.
     board, san_sequence = simulate_game(white_tree, black_tree)
-    final_fen = board.fen()
+    moves_played_str = format_san_sequence(san_sequence) if san_sequence else ""
 
-    # Print file names, final FEN, and moves played (only once).
-    print("White:", args.white)
-    print("Black:", args.black)
-    print("Final FEN:", final_fen)
-    print("\nMoves played to reach this position:")
-    if san_sequence:
-        print(format_san_sequence(san_sequence))
-        logging.debug("Moves played: %s", format_san_sequence(san_sequence))
-    else:
-        print("(No moves played)")
-        logging.debug("No moves were played.")
-
-    # Phase 3: Query Lichess Explorer API (or print mate result).
-    if board.is_checkmate():
-        if board.turn == chess.WHITE:
-            white_wins, draws, black_wins = 0, 0, 1
-        else:
-            white_wins, draws, black_wins = 1, 0, 0
-        total = 1
-        print("\nResult (Mate):")
-        print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
-              f"{white_wins*100:.1f}%/{draws*100:.1f}%/{black_wins*100:.1f}%")
-        logging.debug("Mate reached; simulation ended.")
-        print("\n(Mate reached; no candidate moves table available.)")
-    else:
-        try:
-            white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, args.elo.replace(" ", ""))
-        except Exception as e:
-            logging.debug("API request failed: %s", e)
-            print("API request failed:", e)
-            sys.exit(1)
-        if total > 0:
-            overall_wp = white_wins / total * 100
-            overall_dp = draws / total * 100
-            overall_bp = black_wins / total * 100
-        else:
-            overall_wp = overall_dp = overall_bp = 0
-        print("\nOverall Result from Lichess Explorer:")
-        print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
-              f"{overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
-        logging.debug("Overall API result: %d/%d/%d = %d", white_wins, draws, black_wins, total)
-        moves = api_data.get("moves", [])
-        if moves:
-            current_move_number = board.fullmove_number
-            is_white_turn = board.turn == chess.WHITE
-            print_moves_table(moves, current_move_number, is_white_turn)
-            logging.debug("Candidate moves table printed.")
-        else:
-            print("No candidate moves available in the API response.")
-            logging.debug("No candidate moves available from API.")
+    # Print file names, final FEN and moves played, then Phase 3: the Lichess Explorer
+    # API result (or the mate result).
+    print_results(board.fen(), moves_played_str, board, args.white, args.black, ratings,
+                  use_cache=not args.no_cache)
 
 if __name__ == '__main__':
     main()
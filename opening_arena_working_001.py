@@ -3,14 +3,41 @@ import argparse
 import chess
 import chess.pgn
 import requests
+from requests.adapters import HTTPAdapter
+
+# Shared session: keep-alive and connection pooling for Lichess Explorer calls.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "opening_arena"})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+class MainlineMoves(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records only a game's mainline moves.
+    Variations are skipped and comments/NAGs ignored, so no Game/ChildNode tree is built.
+    """
+    def begin_game(self):
+        self.moves = []
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
 
 def load_first_game_moves(filename):
     """Load moves from the first game in a PGN file."""
     with open(filename, 'r') as pgn_file:
-        game = chess.pgn.read_game(pgn_file)
+        game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
     if game is None:
         raise ValueError(f"No game found in PGN file: {filename}")
-    return list(game.mainline_moves())
+    return game.moves
 
 def main():
     parser = argparse.ArgumentParser(
@@ -58,7 +85,7 @@ def main():
     print("FEN:", fen)
 
     # Check if the final move delivered mate.
-    if board.is_checkmate():
+    if board.is_check() and board.is_checkmate():
         # board.turn is the side to move (which is checkmated).
         if board.turn == chess.WHITE:
             # White is checkmated; black wins.
@@ -81,7 +108,7 @@ def main():
         }
         api_url = "https://explorer.lichess.ovh/lichess"
         try:
-            response = requests.get(api_url, params=params)
+            response = _SESSION.get(api_url, params=params, timeout=10)
             response.raise_for_status()
         except Exception as e:
             print("API request failed:", e)
@@ -1,8 +1,131 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import pickle
+import shelve
+import threading
+from urllib.parse import urlencode
 import chess
 import chess.pgn
+import chess.polyglot
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared session: keep-alive and connection pooling for Lichess Explorer calls, retrying
+# rate-limited (429) and transient server failures with backoff.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "opening_arena"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+
+# The Explorer request is prepared once (URL, fixed query fields, session headers);
+# each query copies it and appends only its own ratings and FEN to the query string.
+_API_URL = "https://explorer.lichess.ovh/lichess"
+_BASE_REQUEST = _SESSION.prepare_request(requests.Request(
+    "GET", _API_URL, params={"variant": "standard", "speeds": "blitz,rapid,classical"}))
+
+def explorer_request(fen, ratings):
+    """Return a ready-to-send PreparedRequest for one Explorer query."""
+    request = _BASE_REQUEST.copy()
+    request.url = _BASE_REQUEST.url + "&" + urlencode({"ratings": ratings, "fen": fen})
+    return request
+
+# On-disk cache of Explorer responses, keyed by (position, ratings).
+_CACHE_PATH = os.path.expanduser("~/.cache/opening_arena/explorer")
+_CACHE_LOCK = threading.Lock()
+# In-process layer in front of the disk cache, keyed by (Zobrist hash, ratings).
+_MEMORY_CACHE = {}
+
+def explorer_cache_key(fen, ratings):
+    """
+    Build the cache key for a query: the FEN without its halfmove/fullmove counters
+    (piece placement, turn, castling, en passant) plus the ratings string.
+    """
+    return " ".join(fen.split()[:4]) + "|" + ratings.replace(" ", "")
+
+# The cache is best-effort: if it cannot be opened (e.g. an unwritable home directory),
+# lookups miss and stores are dropped, so queries go straight to the Explorer.
+def cache_get(key):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                return cache.get(key)
+        except Exception:
+            return None
+
+def cache_set(key, data):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                cache[key] = data
+        except Exception:
+            pass
+
+# Parsed repertoires are pickled next to the Explorer cache, one file per
+# (script, loader, PGN path, mtime, size), so unchanged books skip the PGN parser.
+_PGN_CACHE_DIR = os.path.dirname(_CACHE_PATH)
+
+def load_repertoire_cached(loader, filename):
+    """
+    Return loader(filename), reusing a pickled result from a previous run while the
+    PGN file's modification time and size are unchanged.
+    """
+    stat = os.stat(filename)
+    # The script's own mtime is part of the key so an edited loader never sees stale pickles,
+    # and the module name, since results pickled by the script reference __main__ classes.
+    key = (os.path.abspath(__file__), os.stat(__file__).st_mtime_ns, __name__, loader.__name__,
+           os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    pickle_path = os.path.join(_PGN_CACHE_DIR, f"pgn_{digest}.pkl")
+    try:
+        with open(pickle_path, 'rb') as pickle_file:
+            return pickle.load(pickle_file)
+    except Exception:
+        # The cache is best-effort: a missing, corrupt or incompatible pickle just means a reload.
+        pass
+    result = loader(filename)
+    try:
+        os.makedirs(_PGN_CACHE_DIR, exist_ok=True)
+        with open(pickle_path, 'wb') as pickle_file:
+            pickle.dump(result, pickle_file, pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # unwritable cache dir: keep the freshly loaded result uncached
+    return result
+
+def encode_move(move):
+    """Pack a chess.Move into a 16-bit int: from square | to square << 6 | promotion << 12."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+class MovesOnly(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records only a game's mainline moves, split into White's and Black's.
+    Variations are skipped and comments/NAGs ignored, so no Game/ChildNode tree is built.
+    """
+    def begin_game(self):
+        self.white_moves = []
+        self.black_moves = []
+
+    def visit_move(self, board, move):
+        if board.turn == chess.WHITE:
+            self.white_moves.append(move)
+        else:
+            self.black_moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
 
 def load_white_repertoire(filename):
     """
@@ -10,67 +133,61 @@ def load_white_repertoire(filename):
     Returns a list of white moves (as chess.Move objects) for that game.
     """
     with open(filename, 'r') as pgn_file:
-        game = chess.pgn.read_game(pgn_file)
+        game = chess.pgn.read_game(pgn_file, Visitor=MovesOnly)
     if game is None:
         raise ValueError(f"No game found in PGN file: {filename}")
-    board = chess.Board()
-    white_moves = []
-    for move in game.mainline_moves():
-        # Record move if it's White's move.
-        if board.turn == chess.WHITE:
-            white_moves.append(move)
-        board.push(move)
-    return white_moves
+    return game.white_moves
 
 def load_black_repertoire(filename):
     """
     Load all games from the black repertoire file.
-    For each game, record the moves made by White and by Black
-    (each as a list of UCI strings).
-    Returns a list of dictionaries with keys: 'white_moves' and 'black_moves'.
+    For each game, record the moves made by White (as encoded moves, see encode_move)
+    and by Black (as chess.Move objects).
+    Returns a trie (nested dictionaries) keyed by White's encoded moves, where each
+    node stores under '__reply__' the black reply (or None) of the first game passing through it.
     """
     games = []
     with open(filename, 'r') as pgn_file:
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MovesOnly)
             if game is None:
                 break
-            board = chess.Board()
-            white_line = []
-            black_line = []
-            for move in game.mainline_moves():
-                if board.turn == chess.WHITE:
-                    white_line.append(move.uci())
-                else:
-                    black_line.append(move.uci())
-                board.push(move)
+            white_line = [encode_move(move) for move in game.white_moves]
+            # Black's replies are only ever played, never matched, so keep the Move objects.
+            black_line = game.black_moves
             games.append({
                 'white_moves': white_line,
                 'black_moves': black_line
             })
     if not games:
         raise ValueError(f"No games found in PGN file: {filename}")
-    return games
+    trie = {}
+    for game in games:
+        node = trie
+        black_moves = game['black_moves']
+        for i, move_code in enumerate(game['white_moves']):
+            node = node.setdefault(move_code, {})
+            node.setdefault('__reply__', black_moves[i] if i < len(black_moves) else None)
+    return trie
 
-def simulate_opening(white_moves, black_games):
+def simulate_opening(white_moves, black_trie):
     """
     Simulate an opening battle:
       - white_moves: list of chess.Move objects (from white repertoire's first game)
-      - black_games: list of dictionaries (each with keys 'white_moves' and 'black_moves')
+      - black_trie: trie of the black repertoire keyed by White's encoded moves
     The simulation proceeds as follows:
       1. Start with an empty board.
-      2. On White's turn, play the next move from white_moves if available.
-      3. On Black's turn, search black_games for a candidate game where the
-         white moves played so far (as UCI strings) match the candidate's white_moves prefix.
-         If found and if a black move is available in that candidate, play it.
+      2. On White's turn, play the next move from white_moves if available,
+         and descend the trie by that move.
+      3. On Black's turn, the current trie node holds the reply of the first game
+         whose white moves match those played so far. If that game has one, play it.
       4. Stop as soon as one side is "out-of-book".
     Returns the final board position.
     """
     board = chess.Board()
     white_index = 0
-    black_index = 0  # counts black moves played in the simulation
-    # We'll record the white moves played (as UCI strings) to match against black games.
-    played_white_moves = []
+    # Trie node matching the white moves played so far (None once off the black book).
+    node = black_trie
 
     while True:
         if board.turn == chess.WHITE:
@@ -78,37 +195,22 @@ def simulate_opening(white_moves, black_games):
             if white_index < len(white_moves):
                 move = white_moves[white_index]
                 white_index += 1
-                played_white_moves.append(move.uci())
+                if node is not None:
+                    node = node.get(encode_move(move))
                 board.push(move)
             else:
                 # White is out-of-book.
                 break
         else:  # Black's turn.
-            # Look for a black game candidate whose white_moves prefix matches what White has played.
-            candidate = None
-            for game in black_games:
-                # To have a candidate, the game must have at least as many white moves as played.
-                if len(game['white_moves']) >= len(played_white_moves):
-                    if game['white_moves'][:len(played_white_moves)] == played_white_moves:
-                        candidate = game
-                        break
-            if candidate is None:
+            if node is None:
                 # No matching black repertoire available.
                 break
-            # Determine the next black move index.
-            if black_index < len(candidate['black_moves']):
-                # Get the candidate black move as UCI and convert it back to a Move object.
-                move_uci = candidate['black_moves'][black_index]
-                try:
-                    move = chess.Move.from_uci(move_uci)
-                except Exception as e:
-                    print("Error converting move:", e)
-                    break
+            move = node['__reply__']
+            if move is not None:
                 # Verify that the move is legal in the current board.
-                if move not in board.legal_moves:
+                if not board.is_legal(move):
                     # If it isn't legal, break out.
                     break
-                black_index += 1
                 board.push(move)
             else:
                 # Candidate does not provide a move; black is out-of-book.
@@ -116,27 +218,53 @@ def simulate_opening(white_moves, black_games):
 
     return board
 
-def query_lichess(fen, ratings):
+def query_lichess(board, ratings):
     """
-    Given a FEN and ratings string, query the Lichess Explorer API.
+    Given a board and ratings string, query the Lichess Explorer API for its position.
     Returns a tuple (white_wins, draws, black_wins, total).
     """
-    params = {
-        "variant": "standard",
-        "speeds": "blitz,rapid,classical",
-        "ratings": ratings,
-        "fen": fen
-    }
-    api_url = "https://explorer.lichess.ovh/lichess"
-    response = requests.get(api_url, params=params)
-    response.raise_for_status()
-    data = response.json()
+    memory_key = (chess.polyglot.zobrist_hash(board), ratings)
+    data = _MEMORY_CACHE.get(memory_key)
+    if data is not None:
+        return summarize_explorer_data(data)
+    # Only build the FEN once we actually need the disk cache or the network.
+    fen = board.fen()
+    key = explorer_cache_key(fen, ratings)
+    data = cache_get(key)
+    if data is None:
+        request = explorer_request(fen, ratings)
+        # Session.send skips the environment lookup Session.get would do, so apply it here.
+        settings = _SESSION.merge_environment_settings(request.url, {}, None, None, None)
+        response = _SESSION.send(request, timeout=10, **settings)
+        response.raise_for_status()
+        data = response.json()
+        cache_set(key, data)
+    _MEMORY_CACHE[memory_key] = data
+    return summarize_explorer_data(data)
+
+def summarize_explorer_data(data):
+    """Extract the overall white/draw/black counts from an Explorer JSON response."""
     white_wins = data.get("white", 0)
     draws = data.get("draws", 0)
     black_wins = data.get("black", 0)
     total = white_wins + draws + black_wins
     return white_wins, draws, black_wins, total
 
+def parse_elo_brackets(elo):
+    """Split a comma separated -e/--elo value into its non-empty ELO brackets."""
+    return [bracket for bracket in elo.replace(" ", "").split(",") if bracket]
+
+def query_lichess_brackets(board, brackets):
+    """
+    Query the Lichess Explorer API once per ELO bracket, concurrently over the shared session
+    (at most 4 requests in flight, as Lichess rate-limits parallel clients).
+    Returns a list of (bracket, white_wins, draws, black_wins, total) tuples
+    in the order the brackets were given.
+    """
+    with ThreadPoolExecutor(max_workers=min(4, len(brackets))) as executor:
+        results = list(executor.map(lambda bracket: query_lichess(board, bracket), brackets))
+    return [(bracket,) + result for bracket, result in zip(brackets, results)]
+
 def main():
     parser = argparse.ArgumentParser(
         description="Opening Arena: Evaluate opening repertoires via Lichess Explorer API"
@@ -148,24 +276,27 @@ def main():
     parser.add_argument('-e', '--elo', required=True,
                         help="Comma separated ELO brackets (e.g. 1200,1400,1600,1800)")
     args = parser.parse_args()
+    brackets = parse_elo_brackets(args.elo)
+    if not brackets:
+        parser.error("argument -e/--elo: expected at least one ELO bracket (e.g. 1600,1800)")
 
     try:
         # Load white moves (first game only) and all black games.
-        white_moves = load_white_repertoire(args.white)
-        black_games = load_black_repertoire(args.black)
+        white_moves = load_repertoire_cached(load_white_repertoire, args.white)
+        black_trie = load_repertoire_cached(load_black_repertoire, args.black)
     except Exception as ex:
         print("Error loading PGN files:", ex)
         return
 
     # Simulate the opening battle.
-    board = simulate_opening(white_moves, black_games)
+    board = simulate_opening(white_moves, black_trie)
     fen = board.fen()
     print("White:", args.white)
     print("Black:", args.black)
     print("FEN:", fen)
 
     # If the last move delivered mate, force the stats.
-    if board.is_checkmate():
+    if board.is_check() and board.is_checkmate():
         # board.turn is the side to move (who is checkmated).
         if board.turn == chess.WHITE:
             # White is checkmated; Black wins.
@@ -174,13 +305,18 @@ def main():
             # Black is checkmated; White wins.
             white_wins, draws, black_wins = 1, 0, 0
         total = 1
+        bracket_results = []
     else:
-        # Otherwise, query the Lichess Explorer API.
+        # Otherwise, query the Lichess Explorer API (one request per ELO bracket).
         try:
-            white_wins, draws, black_wins, total = query_lichess(fen, args.elo.replace(" ", ""))
+            bracket_results = query_lichess_brackets(board, brackets)
         except Exception as e:
             print("API request failed:", e)
             return
+        white_wins = sum(result[1] for result in bracket_results)
+        draws = sum(result[2] for result in bracket_results)
+        black_wins = sum(result[3] for result in bracket_results)
+        total = white_wins + draws + black_wins
 
     # Calculate percentages.
     if total > 0:
@@ -193,5 +329,13 @@ def main():
     print(f"Results: {white_wins}/{draws}/{black_wins} = {total} "
           f"= {perc_white:.1f}%/{perc_draws:.1f}%/{perc_black:.1f}%")
 
+    # One row per ELO bracket.
+    for bracket, w, d, b, tot in bracket_results:
+        if tot > 0:
+            print(f"  {bracket}: {w}/{d}/{b} = {tot} "
+                  f"= {w / tot * 100:.1f}%/{d / tot * 100:.1f}%/{b / tot * 100:.1f}%")
+        else:
+            print(f"  {bracket}: {w}/{d}/{b} = {tot}")
+
 if __name__ == '__main__':
     main()
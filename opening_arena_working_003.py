@@ -1,8 +1,132 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import pickle
+import shelve
+import sys
+import threading
+from urllib.parse import urlencode
 import chess
 import chess.pgn
+import chess.polyglot
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared session: keep-alive and connection pooling for Lichess Explorer calls, retrying
+# rate-limited (429) and transient server failures with backoff.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "opening_arena"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+
+# The Explorer request is prepared once (URL, fixed query fields, session headers);
+# each query copies it and appends only its own ratings and FEN to the query string.
+_API_URL = "https://explorer.lichess.ovh/lichess"
+_BASE_REQUEST = _SESSION.prepare_request(requests.Request(
+    "GET", _API_URL, params={"variant": "standard", "speeds": "blitz,rapid,classical"}))
+
+def explorer_request(fen, ratings):
+    """Return a ready-to-send PreparedRequest for one Explorer query."""
+    request = _BASE_REQUEST.copy()
+    request.url = _BASE_REQUEST.url + "&" + urlencode({"ratings": ratings, "fen": fen})
+    return request
+
+# On-disk cache of Explorer responses, keyed by (position, ratings).
+_CACHE_PATH = os.path.expanduser("~/.cache/opening_arena/explorer")
+_CACHE_LOCK = threading.Lock()
+# In-process layer in front of the disk cache, keyed by (Zobrist hash, ratings).
+_MEMORY_CACHE = {}
+
+def explorer_cache_key(fen, ratings):
+    """
+    Build the cache key for a query: the FEN without its halfmove/fullmove counters
+    (piece placement, turn, castling, en passant) plus the ratings string.
+    """
+    return " ".join(fen.split()[:4]) + "|" + ratings.replace(" ", "")
+
+# The cache is best-effort: if it cannot be opened (e.g. an unwritable home directory),
+# lookups miss and stores are dropped, so queries go straight to the Explorer.
+def cache_get(key):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                return cache.get(key)
+        except Exception:
+            return None
+
+def cache_set(key, data):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                cache[key] = data
+        except Exception:
+            pass
+
+# Parsed repertoires are pickled next to the Explorer cache, one file per
+# (script, loader, PGN path, mtime, size), so unchanged books skip the PGN parser.
+_PGN_CACHE_DIR = os.path.dirname(_CACHE_PATH)
+
+def load_repertoire_cached(loader, filename):
+    """
+    Return loader(filename), reusing a pickled result from a previous run while the
+    PGN file's modification time and size are unchanged.
+    """
+    stat = os.stat(filename)
+    # The script's own mtime is part of the key so an edited loader never sees stale pickles,
+    # and the module name, since results pickled by the script reference __main__ classes.
+    key = (os.path.abspath(__file__), os.stat(__file__).st_mtime_ns, __name__, loader.__name__,
+           os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    pickle_path = os.path.join(_PGN_CACHE_DIR, f"pgn_{digest}.pkl")
+    try:
+        with open(pickle_path, 'rb') as pickle_file:
+            return pickle.load(pickle_file)
+    except Exception:
+        # The cache is best-effort: a missing, corrupt or incompatible pickle just means a reload.
+        pass
+    result = loader(filename)
+    try:
+        os.makedirs(_PGN_CACHE_DIR, exist_ok=True)
+        with open(pickle_path, 'wb') as pickle_file:
+            pickle.dump(result, pickle_file, pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # unwritable cache dir: keep the freshly loaded result uncached
+    return result
+
+def encode_move(move):
+    """Pack a chess.Move into a 16-bit int: from square | to square << 6 | promotion << 12."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+class MovesOnly(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records only a game's mainline moves, split into White's and Black's.
+    Variations are skipped and comments/NAGs ignored, so no Game/ChildNode tree is built.
+    """
+    def begin_game(self):
+        self.white_moves = []
+        self.black_moves = []
+
+    def visit_move(self, board, move):
+        if board.turn == chess.WHITE:
+            self.white_moves.append(move)
+        else:
+            self.black_moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
 
 def load_white_repertoire(filename):
     """
@@ -10,117 +134,170 @@ def load_white_repertoire(filename):
     Return its moves as a list of chess.Move objects.
     """
     with open(filename, 'r') as pgn_file:
-        game = chess.pgn.read_game(pgn_file)
+        game = chess.pgn.read_game(pgn_file, Visitor=MovesOnly)
     if game is None:
         raise ValueError(f"No game found in PGN file: {filename}")
-    board = chess.Board()
-    white_moves = []
-    for move in game.mainline_moves():
-        if board.turn == chess.WHITE:
-            white_moves.append(move)
-        board.push(move)
-    return white_moves
+    return game.white_moves
 
 def load_black_repertoire(filename):
     """
     Load all games from the black repertoire file.
-    For each game record the white moves and black moves as lists of UCI strings.
-    Returns a list of dictionaries, each with keys 'white_moves' and 'black_moves'.
+    For each game record the white moves as encoded moves (see encode_move) and the
+    black moves as chess.Move objects, then fold the games into a trie keyed by White's encoded moves.
+    Every trie node stores, under '__reply__', the black reply (or None) of the first
+    game whose white moves pass through that node.
     """
     games = []
     with open(filename, 'r') as pgn_file:
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MovesOnly)
             if game is None:
                 break
-            board = chess.Board()
-            white_line = []
-            black_line = []
-            for move in game.mainline_moves():
-                if board.turn == chess.WHITE:
-                    white_line.append(move.uci())
-                else:
-                    black_line.append(move.uci())
-                board.push(move)
+            white_line = [encode_move(move) for move in game.white_moves]
+            # Black's replies are only ever played, never matched, so keep the Move objects.
+            black_line = game.black_moves
             games.append({'white_moves': white_line, 'black_moves': black_line})
     if not games:
         raise ValueError(f"No games found in PGN file: {filename}")
-    return games
+    trie = {}
+    for game in games:
+        node = trie
+        black_moves = game['black_moves']
+        for i, move_code in enumerate(game['white_moves']):
+            node = node.setdefault(move_code, {})
+            node.setdefault('__reply__', black_moves[i] if i < len(black_moves) else None)
+    return trie
 
-def simulate_opening(white_moves, black_games):
+def simulate_opening(white_moves, black_trie):
     """
     Simulate the opening battle:
       - white_moves: list of chess.Move objects (from white repertoire)
-      - black_games: list of dicts from the black repertoire
+      - black_trie: trie of the black repertoire keyed by White's encoded moves
     On each turn:
-      * White plays the next white move from white_moves.
-      * Black looks for the first game in black_games where the white moves played so far match
-        that game's white_moves prefix. If found and a black move exists, that move is played.
+      * White plays the next white move from white_moves and the trie descends one node.
+      * Black plays the reply stored at the current node (from the first game in the black
+        repertoire whose white moves match those played so far), if it has one.
     Stops when one side is out-of-book.
     Returns the final board.
     """
     board = chess.Board()
     white_index = 0
-    black_index = 0  # index for black move in the candidate game
-    played_white_moves = []  # record white moves in UCI to match against black games
+    node = black_trie  # trie node for the white moves played so far
 
     while True:
         if board.turn == chess.WHITE:
             if white_index < len(white_moves):
                 move = white_moves[white_index]
                 white_index += 1
-                played_white_moves.append(move.uci())
+                if node is not None:
+                    node = node.get(encode_move(move))
                 board.push(move)
             else:
                 break  # White out-of-book
         else:  # Black's turn
-            candidate = None
-            for game in black_games:
-                # Only consider candidate if game has at least as many white moves as played so far
-                if len(game['white_moves']) >= len(played_white_moves):
-                    if game['white_moves'][:len(played_white_moves)] == played_white_moves:
-                        candidate = game
-                        break
-            if candidate is None:
+            if node is None:
                 break  # No matching black repertoire move found
-            if black_index < len(candidate['black_moves']):
-                move_uci = candidate['black_moves'][black_index]
-                try:
-                    move = chess.Move.from_uci(move_uci)
-                except Exception as e:
-                    print("Error converting move:", e)
-                    break
-                if move not in board.legal_moves:
+            move = node['__reply__']
+            if move is not None:
+                if not board.is_legal(move):
                     break  # Illegal move found
-                black_index += 1
                 board.push(move)
             else:
                 break  # Candidate game does not provide further black moves
 
     return board
 
-def query_lichess(fen, ratings):
+def query_lichess(board, ratings):
     """
-    Query the Lichess Explorer API with the given FEN and ratings.
+    Query the Lichess Explorer API with the given board's position and ratings.
     Returns a tuple: (white_wins, draws, black_wins, total, api_data)
     where api_data is the full JSON response.
     """
-    params = {
-        "variant": "standard",
-        "speeds": "blitz,rapid,classical",
-        "ratings": ratings,
-        "fen": fen
-    }
-    api_url = "https://explorer.lichess.ovh/lichess"
-    response = requests.get(api_url, params=params)
-    response.raise_for_status()
-    data = response.json()
+    memory_key = (chess.polyglot.zobrist_hash(board), ratings)
+    data = _MEMORY_CACHE.get(memory_key)
+    if data is not None:
+        return summarize_explorer_data(data)
+    # Only build the FEN once we actually need the disk cache or the network.
+    fen = board.fen()
+    key = explorer_cache_key(fen, ratings)
+    data = cache_get(key)
+    if data is None:
+        request = explorer_request(fen, ratings)
+        # Session.send skips the environment lookup Session.get would do, so apply it here.
+        settings = _SESSION.merge_environment_settings(request.url, {}, None, None, None)
+        response = _SESSION.send(request, timeout=10, **settings)
+        response.raise_for_status()
+        data = response.json()
+        cache_set(key, data)
+    _MEMORY_CACHE[memory_key] = data
+    return summarize_explorer_data(data)
+
+def summarize_explorer_data(data):
+    """Extract the overall white/draw/black counts from an Explorer JSON response."""
     white_wins = data.get("white", 0)
     draws = data.get("draws", 0)
     black_wins = data.get("black", 0)
     total = white_wins + draws + black_wins
     return white_wins, draws, black_wins, total, data
 
+def parse_elo_brackets(elo):
+    """Split a comma separated -e/--elo value into its non-empty ELO brackets."""
+    return [bracket for bracket in elo.replace(" ", "").split(",") if bracket]
+
+def query_lichess_brackets(board, brackets):
+    """
+    Query the Lichess Explorer API once per ELO bracket, concurrently over the shared session
+    (at most 4 requests in flight, as Lichess rate-limits parallel clients).
+    Returns a list of (bracket, white_wins, draws, black_wins, total, api_data) tuples
+    in the order the brackets were given.
+    """
+    with ThreadPoolExecutor(max_workers=min(4, len(brackets))) as executor:
+        results = list(executor.map(lambda bracket: query_lichess(board, bracket), brackets))
+    return [(bracket,) + result for bracket, result in zip(brackets, results)]
+
+def combine_bracket_results(bracket_results):
+    """
+    Sum the per-bracket results into a single (white_wins, draws, black_wins, total, api_data)
+    tuple. Candidate moves from every bracket are merged by UCI, most played first.
+    """
+    white_wins = draws = black_wins = 0
+    merged_moves = {}
+    for _, w, d, b, _, data in bracket_results:
+        white_wins += w
+        draws += d
+        black_wins += b
+        for m in data.get("moves", []):
+            merged = merged_moves.setdefault(m.get("uci"), dict(m, white=0, draws=0, black=0))
+            merged["white"] += m.get("white", 0)
+            merged["draws"] += m.get("draws", 0)
+            merged["black"] += m.get("black", 0)
+    moves = sorted(merged_moves.values(),
+                   key=lambda m: m["white"] + m["draws"] + m["black"], reverse=True)
+    total = white_wins + draws + black_wins
+    return white_wins, draws, black_wins, total, {"white": white_wins, "draws": draws,
+                                                  "black": black_wins, "moves": moves}
+
+# Row layout shared by the result tables, bound once so the format spec is parsed once.
+TABLE_ROW = "{:<12} {:10} {:10} {:10} {:10} {:7.1f}% {:7.1f}% {:7.1f}%".format
+
+def print_bracket_table(bracket_results):
+    """
+    Print one row per ELO bracket with its white/draw/black counts and percentages.
+    """
+    header = (f"{'ELO':<12} {'White':>10} {'Draws':>10} {'Black':>10} {'Total':>10} "
+              f"{'W%':>8} {'D%':>8} {'B%':>8}")
+    # Collect every line and write the table in one call.
+    lines = ["\nResults by ELO Bracket:", header, "-" * len(header)]
+    for bracket, w, d, b, tot, _ in bracket_results:
+        if tot > 0:
+            wp = w / tot * 100
+            dp = d / tot * 100
+            bp = b / tot * 100
+        else:
+            wp = dp = bp = 0
+        lines.append(TABLE_ROW(bracket, w, d, b, tot, wp, dp, bp))
+    sys.stdout.write("\n".join(lines) + "\n")
+
 def print_moves_table(moves):
     """
     Given a list of move candidate dictionaries from the API,
@@ -128,9 +305,8 @@ def print_moves_table(moves):
     """
     header = (f"{'Move':<12} {'White':>10} {'Draws':>10} {'Black':>10} {'Total':>10} "
               f"{'W%':>8} {'D%':>8} {'B%':>8}")
-    print("\nCandidate Moves:")
-    print(header)
-    print("-" * len(header))
+    # Collect every line and write the table in one call.
+    lines = ["\nCandidate Moves:", header, "-" * len(header)]
     for m in moves:
         # Use SAN if available; otherwise use UCI.
         move_str = m.get("san", m.get("uci", ""))
@@ -144,8 +320,8 @@ def print_moves_table(moves):
             bp = b / tot * 100
         else:
             wp = dp = bp = 0
-        print(f"{move_str:<12} {w:10} {d:10} {b:10} {tot:10} "
-              f"{wp:7.1f}% {dp:7.1f}% {bp:7.1f}%")
+        lines.append(TABLE_ROW(move_str, w, d, b, tot, wp, dp, bp))
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -158,24 +334,27 @@ def main():
     parser.add_argument('-e', '--elo', required=True,
                         help="Comma separated ELO brackets (e.g. 1200,1400,1600,1800)")
     args = parser.parse_args()
+    brackets = parse_elo_brackets(args.elo)
+    if not brackets:
+        parser.error("argument -e/--elo: expected at least one ELO bracket (e.g. 1600,1800)")
 
     try:
         # Load white repertoire (first game) and all black repertoire games.
-        white_moves = load_white_repertoire(args.white)
-        black_games = load_black_repertoire(args.black)
+        white_moves = load_repertoire_cached(load_white_repertoire, args.white)
+        black_trie = load_repertoire_cached(load_black_repertoire, args.black)
     except Exception as ex:
         print("Error loading PGN files:", ex)
         return
 
     # Simulate the opening battle.
-    board = simulate_opening(white_moves, black_games)
+    board = simulate_opening(white_moves, black_trie)
     fen = board.fen()
     print("White:", args.white)
     print("Black:", args.black)
     print("FEN:", fen)
 
     # If the position is mate, force result to 100% for the winning side.
-    if board.is_checkmate():
+    if board.is_check() and board.is_checkmate():
         if board.turn == chess.WHITE:
             # White to move but is mated; Black wins.
             white_wins, draws, black_wins = 0, 0, 1
@@ -188,10 +367,11 @@ def main():
         print("\n(Mate reached; no candidate moves table available.)")
     else:
         try:
-            white_wins, draws, black_wins, total, api_data = query_lichess(fen, args.elo.replace(" ", ""))
+            bracket_results = query_lichess_brackets(board, brackets)
         except Exception as e:
             print("API request failed:", e)
             return
+        white_wins, draws, black_wins, total, api_data = combine_bracket_results(bracket_results)
 
         if total > 0:
             overall_wp = white_wins / total * 100
@@ -203,6 +383,7 @@ def main():
         print("\nOverall Result from Lichess Explorer:")
         print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} "
               f"= {overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
+        print_bracket_table(bracket_results)
 
         # Print a table for each candidate move from the API.
         moves = api_data.get("moves", [])
@@ -1,57 +1,191 @@
 #!/usr/bin/env python3
 import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import pickle
+import shelve
+import sys
+import threading
+from urllib.parse import urlencode
 import chess
 import chess.pgn
+import chess.polyglot
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared session: keep-alive and connection pooling for Lichess Explorer calls, retrying
+# rate-limited (429) and transient server failures with backoff.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "opening_arena"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+
+# The Explorer request is prepared once (URL, fixed query fields, session headers);
+# each query copies it and appends only its own ratings and FEN to the query string.
+_API_URL = "https://explorer.lichess.ovh/lichess"
+_BASE_REQUEST = _SESSION.prepare_request(requests.Request(
+    "GET", _API_URL, params={"variant": "standard", "speeds": "blitz,rapid,classical"}))
+
+def explorer_request(fen, ratings):
+    """Return a ready-to-send PreparedRequest for one Explorer query."""
+    request = _BASE_REQUEST.copy()
+    request.url = _BASE_REQUEST.url + "&" + urlencode({"ratings": ratings, "fen": fen})
+    return request
+
+# On-disk cache of Explorer responses, keyed by (position, ratings).
+_CACHE_PATH = os.path.expanduser("~/.cache/opening_arena/explorer")
+_CACHE_LOCK = threading.Lock()
+# In-process layer in front of the disk cache, keyed by (Zobrist hash, ratings).
+_MEMORY_CACHE = {}
+
+def explorer_cache_key(fen, ratings):
+    """
+    Build the cache key for a query: the FEN without its halfmove/fullmove counters
+    (piece placement, turn, castling, en passant) plus the ratings string.
+    """
+    return " ".join(fen.split()[:4]) + "|" + ratings.replace(" ", "")
+
+# The cache is best-effort: if it cannot be opened (e.g. an unwritable home directory),
+# lookups miss and stores are dropped, so queries go straight to the Explorer.
+def cache_get(key):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                return cache.get(key)
+        except Exception:
+            return None
+
+def cache_set(key, data):
+    with _CACHE_LOCK:
+        try:
+            os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+            with shelve.open(_CACHE_PATH) as cache:
+                cache[key] = data
+        except Exception:
+            pass
+
+# Parsed repertoires are pickled next to the Explorer cache, one file per
+# (script, loader, PGN path, mtime, size), so unchanged books skip the PGN parser.
+_PGN_CACHE_DIR = os.path.dirname(_CACHE_PATH)
+
+def load_repertoire_cached(loader, filename):
+    """
+    Return loader(filename), reusing a pickled result from a previous run while the
+    PGN file's modification time and size are unchanged.
+    """
+    stat = os.stat(filename)
+    # The script's own mtime is part of the key so an edited loader never sees stale pickles,
+    # and the module name, since results pickled by the script reference __main__ classes.
+    key = (os.path.abspath(__file__), os.stat(__file__).st_mtime_ns, __name__, loader.__name__,
+           os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    pickle_path = os.path.join(_PGN_CACHE_DIR, f"pgn_{digest}.pkl")
+    try:
+        with open(pickle_path, 'rb') as pickle_file:
+            return pickle.load(pickle_file)
+    except Exception:
+        # The cache is best-effort: a missing, corrupt or incompatible pickle just means a reload.
+        pass
+    result = loader(filename)
+    try:
+        os.makedirs(_PGN_CACHE_DIR, exist_ok=True)
+        with open(pickle_path, 'wb') as pickle_file:
+            pickle.dump(result, pickle_file, pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # unwritable cache dir: keep the freshly loaded result uncached
+    return result
+
+def encode_move(move):
+    """Pack a chess.Move into a 16-bit int: from square | to square << 6 | promotion << 12."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+# A book move keeps both its encoded form (for trie/prefix-key lookups) and the
+# chess.Move itself (to push), so neither has to be rebuilt from the other while simulating.
+BookMove = namedtuple("BookMove", ["code", "move"])
+
+# A move sequence is packed into one int, 16 bits per move, behind a leading 1 bit
+# so that sequences of different lengths never collide.
+EMPTY_PREFIX_KEY = 1
+
+def extend_prefix_key(key, move_code):
+    """Append an encoded move to a packed move-sequence key."""
+    return (key << 16) | move_code
+
+class MovesOnly(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records only a game's mainline moves, split into White's and Black's.
+    Variations are skipped and comments/NAGs ignored, so no Game/ChildNode tree is built.
+    """
+    def begin_game(self):
+        self.white_moves = []
+        self.black_moves = []
+
+    def visit_move(self, board, move):
+        if board.turn == chess.WHITE:
+            self.white_moves.append(move)
+        else:
+            self.black_moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
 
 def load_white_repertoire(filename):
     """
     Load all games from the white repertoire PGN file.
-    Each game is treated as one variation (a “line”) and only White’s moves (as UCI strings) are recorded.
-    Returns a list of variations (each a list of UCI moves).
+    Each game is treated as one variation (a “line”) and only White’s moves (as encoded moves, see encode_move) are recorded.
+    Returns the variations folded into a trie keyed by White's encoded moves; each node stores
+    under '__next__' the next move (as a BookMove) of the first variation passing through it.
     """
     white_lines = []
     with open(filename, 'r') as pgn_file:
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MovesOnly)
             if game is None:
                 break
-            board = chess.Board()
-            line = []
             # Record only White's moves.
-            for move in game.mainline_moves():
-                if board.turn == chess.WHITE:
-                    line.append(move.uci())
-                board.push(move)
+            line = [BookMove(encode_move(move), move) for move in game.white_moves]
             if line:
                 white_lines.append(line)
     if not white_lines:
         raise ValueError(f"No games found in white PGN file: {filename}")
-    return white_lines
+    trie = {}
+    for line in white_lines:
+        node = trie
+        for book_move in line:
+            node.setdefault('__next__', book_move)
+            node = node.setdefault(book_move.code, {})
+    return trie
 
 def load_black_repertoire(filename):
     """
     Load all games from the black repertoire PGN file.
     For each game, record:
-      - 'white_moves': the moves played by White (as UCI strings) that trigger Black’s responses.
-      - 'black_moves': Black’s planned replies (as UCI strings).
-    Returns a list of dictionaries.
+      - 'white_moves': the moves played by White (as encoded moves) that trigger Black’s responses.
+      - 'black_moves': Black’s planned replies (as BookMoves).
+    Returns a prefix map: a dict keyed by the moves played so far (White and Black
+    alternating, ending with a White move, packed by extend_prefix_key) whose value is
+    Black's reply (as a BookMove) from the first such game in the file.
     """
     black_lines = []
     with open(filename, 'r') as pgn_file:
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MovesOnly)
             if game is None:
                 break
-            board = chess.Board()
-            white_line = []
-            black_line = []
-            for move in game.mainline_moves():
-                if board.turn == chess.WHITE:
-                    white_line.append(move.uci())
-                else:
-                    black_line.append(move.uci())
-                board.push(move)
+            white_line = [encode_move(move) for move in game.white_moves]
+            black_line = [BookMove(encode_move(move), move) for move in game.black_moves]
             if white_line or black_line:
                 black_lines.append({
                     'white_moves': white_line,
@@ -59,85 +193,79 @@ def load_black_repertoire(filename):
                 })
     if not black_lines:
         raise ValueError(f"No games found in black PGN file: {filename}")
-    return black_lines
+    prefix_map = {}
+    for game in black_lines:
+        key = EMPTY_PREFIX_KEY
+        for white_move_code, black_move in zip(game['white_moves'], game['black_moves']):
+            key = extend_prefix_key(key, white_move_code)
+            prefix_map.setdefault(key, black_move)
+            key = extend_prefix_key(key, black_move.code)
+    return prefix_map
 
 def simulate_opening(white_book, black_book):
     """
     Simulate the opening battle using the two books.
     
-    white_book: list of white variations (each a list of UCI moves)
-    black_book: list of dicts with keys 'white_moves' and 'black_moves'
+    white_book: trie of white variations keyed by encoded moves (see load_white_repertoire)
+    black_book: prefix map of Black's replies (see load_black_repertoire)
     
     On White’s turn:
-      - Filter white_book for variations whose prefix matches the moves played so far.
-      - If candidate variations exist, pick the next move from the first candidate.
+      - The white_book node for the moves played so far holds the next move of the
+        first matching variation; play it and descend to its child node.
     On Black’s turn:
-      - Filter black_book for games whose white_moves prefix matches the played moves.
-      - If a candidate game is found and it has a Black reply at that juncture, use that reply.
+      - Look up the moves played so far in black_book.
+      - If a game matching them has a Black reply at that juncture, use the first such reply.
     
     The simulation stops when one side is out‑of‑book.
     
-    Returns a tuple (board, san_sequence) where board is the final chess.Board and
-    san_sequence is a list of the moves in SAN order.
+    Returns a tuple (board, moves_played) where board is the final chess.Board and
+    moves_played is the list of chess.Move objects in the order they were played.
+    SAN is not computed here; see to_san_sequence.
     """
     board = chess.Board()
-    played_white = []  # White moves played so far (as UCI strings)
-    san_sequence = []  # Record moves in SAN as they were played
+    played_key = EMPTY_PREFIX_KEY  # Moves played so far by both sides, packed
+    moves_played = []  # Record moves as they were played
 
-    # Work on copies of the books that we prune as we progress.
-    current_white_book = white_book[:]
-    current_black_book = black_book[:]
+    white_node = white_book
 
     while True:
         # WHITE'S TURN:
-        white_candidates = []
-        for line in current_white_book:
-            if len(line) > len(played_white) and line[:len(played_white)] == played_white:
-                white_candidates.append(line[len(played_white)])
-        if not white_candidates:
+        white_move = white_node.get('__next__')
+        if white_move is None:
             # No White move available – out-of-book.
             break
-        white_move_uci = white_candidates[0]  # pick the first candidate
-        try:
-            move = chess.Move.from_uci(white_move_uci)
-        except Exception as e:
-            print("Error converting white move:", e)
-            break
-        if move not in board.legal_moves:
+        white_move_code, move = white_move
+        if not board.is_legal(move):
             break
-        # Record SAN before pushing.
-        san_sequence.append(board.san(move))
+        moves_played.append(move)
         board.push(move)
-        played_white.append(white_move_uci)
-        # Prune white_book: keep only variations that follow the chosen move.
-        current_white_book = [line for line in current_white_book
-                              if len(line) > len(played_white) and line[:len(played_white)] == played_white]
+        played_key = extend_prefix_key(played_key, white_move_code)
+        # Descend to the variations that follow the chosen move.
+        white_node = white_node[white_move_code]
 
         # BLACK'S TURN:
-        black_candidates = []
-        for game in current_black_book:
-            if len(game['white_moves']) >= len(played_white) and game['white_moves'][:len(played_white)] == played_white:
-                # Black's reply index is (number of white moves played - 1)
-                reply_index = len(played_white) - 1
-                if len(game['black_moves']) > reply_index:
-                    black_candidates.append(game['black_moves'][reply_index])
-        if not black_candidates:
+        black_move = black_book.get(played_key)
+        if black_move is None:
             break  # Black out-of-book.
-        black_move_uci = black_candidates[0]
-        try:
-            move = chess.Move.from_uci(black_move_uci)
-        except Exception as e:
-            print("Error converting black move:", e)
-            break
-        if move not in board.legal_moves:
+        black_move_code, move = black_move
+        if not board.is_legal(move):
             break
+        moves_played.append(move)
+        board.push(move)
+        played_key = extend_prefix_key(played_key, black_move_code)
+    return board, moves_played
+
+def to_san_sequence(moves):
+    """
+    Replay the given moves on a fresh board and return them as a list of SAN strings.
+    Only called when the moves are actually printed, since SAN needs legal-move generation.
+    """
+    board = chess.Board()
+    san_sequence = []
+    for move in moves:
         san_sequence.append(board.san(move))
         board.push(move)
-        # Prune black_book to keep only those games that played the chosen Black move.
-        current_black_book = [game for game in current_black_book 
-                              if len(game['black_moves']) > (len(played_white)-1) and 
-                              game['black_moves'][len(played_white)-1] == black_move_uci]
-    return board, san_sequence
+    return san_sequence
 
 def format_san_sequence(san_seq):
     """
@@ -146,41 +274,102 @@ def format_san_sequence(san_seq):
       "1.e4 e5 2.Nf3 Nc6"
     (Note: no space after the move number.)
     """
-    moves = []
-    move_num = 1
-    i = 0
-    while i < len(san_seq):
-        if i + 1 < len(san_seq):
-            moves.append(f"{move_num}.{san_seq[i]} {san_seq[i+1]}")
-            i += 2
-        else:
-            moves.append(f"{move_num}.{san_seq[i]}")
-            i += 1
-        move_num += 1
+    moves = [f"{i // 2 + 1}.{san_seq[i]} {san_seq[i + 1]}" for i in range(0, len(san_seq) - 1, 2)]
+    if len(san_seq) % 2:
+        moves.append(f"{len(san_seq) // 2 + 1}.{san_seq[-1]}")
     return " ".join(moves)
 
-def query_lichess(fen, ratings):
+def query_lichess(board, ratings):
     """
-    Query the Lichess Explorer API using the given FEN and ratings string.
+    Query the Lichess Explorer API using the given board's position and ratings string.
     Returns a tuple: (white_wins, draws, black_wins, total, api_data)
     where api_data is the full JSON response.
     """
-    params = {
-        "variant": "standard",
-        "speeds": "blitz,rapid,classical",
-        "ratings": ratings,
-        "fen": fen
-    }
-    api_url = "https://explorer.lichess.ovh/lichess"
-    response = requests.get(api_url, params=params)
-    response.raise_for_status()
-    data = response.json()
+    memory_key = (chess.polyglot.zobrist_hash(board), ratings)
+    data = _MEMORY_CACHE.get(memory_key)
+    if data is not None:
+        return summarize_explorer_data(data)
+    # Only build the FEN once we actually need the disk cache or the network.
+    fen = board.fen()
+    key = explorer_cache_key(fen, ratings)
+    data = cache_get(key)
+    if data is None:
+        request = explorer_request(fen, ratings)
+        # Session.send skips the environment lookup Session.get would do, so apply it here.
+        settings = _SESSION.merge_environment_settings(request.url, {}, None, None, None)
+        response = _SESSION.send(request, timeout=10, **settings)
+        response.raise_for_status()
+        data = response.json()
+        cache_set(key, data)
+    _MEMORY_CACHE[memory_key] = data
+    return summarize_explorer_data(data)
+
+def summarize_explorer_data(data):
+    """Extract the overall white/draw/black counts from an Explorer JSON response."""
     white_wins = data.get("white", 0)
     draws = data.get("draws", 0)
     black_wins = data.get("black", 0)
     total = white_wins + draws + black_wins
     return white_wins, draws, black_wins, total, data
 
+def parse_elo_brackets(elo):
+    """Split a comma separated -e/--elo value into its non-empty ELO brackets."""
+    return [bracket for bracket in elo.replace(" ", "").split(",") if bracket]
+
+def query_lichess_brackets(board, brackets):
+    """
+    Query the Lichess Explorer API once per ELO bracket, concurrently over the shared session
+    (at most 4 requests in flight, as Lichess rate-limits parallel clients).
+    Returns a list of (bracket, white_wins, draws, black_wins, total, api_data) tuples
+    in the order the brackets were given.
+    """
+    with ThreadPoolExecutor(max_workers=min(4, len(brackets))) as executor:
+        results = list(executor.map(lambda bracket: query_lichess(board, bracket), brackets))
+    return [(bracket,) + result for bracket, result in zip(brackets, results)]
+
+def combine_bracket_results(bracket_results):
+    """
+    Sum the per-bracket results into a single (white_wins, draws, black_wins, total, api_data)
+    tuple. Candidate moves from every bracket are merged by UCI, most played first.
+    """
+    white_wins = draws = black_wins = 0
+    merged_moves = {}
+    for _, w, d, b, _, data in bracket_results:
+        white_wins += w
+        draws += d
+        black_wins += b
+        for m in data.get("moves", []):
+            merged = merged_moves.setdefault(m.get("uci"), dict(m, white=0, draws=0, black=0))
+            merged["white"] += m.get("white", 0)
+            merged["draws"] += m.get("draws", 0)
+            merged["black"] += m.get("black", 0)
+    moves = sorted(merged_moves.values(),
+                   key=lambda m: m["white"] + m["draws"] + m["black"], reverse=True)
+    total = white_wins + draws + black_wins
+    return white_wins, draws, black_wins, total, {"white": white_wins, "draws": draws,
+                                                  "black": black_wins, "moves": moves}
+
+# Row layout shared by the result tables, bound once so the format spec is parsed once.
+TABLE_ROW = "{:<12} {:10} {:10} {:10} {:10} {:7.1f}% {:7.1f}% {:7.1f}%".format
+
+def print_bracket_table(bracket_results):
+    """
+    Print one row per ELO bracket with its white/draw/black counts and percentages.
+    """
+    header = (f"{'ELO':<12} {'White':>10} {'Draws':>10} {'Black':>10} {'Total':>10} "
+              f"{'W%':>8} {'D%':>8} {'B%':>8}")
+    # Collect every line and write the table in one call.
+    lines = ["\nResults by ELO Bracket:", header, "-" * len(header)]
+    for bracket, w, d, b, tot, _ in bracket_results:
+        if tot > 0:
+            wp = w / tot * 100
+            dp = d / tot * 100
+            bp = b / tot * 100
+        else:
+            wp = dp = bp = 0
+        lines.append(TABLE_ROW(bracket, w, d, b, tot, wp, dp, bp))
+    sys.stdout.write("\n".join(lines) + "\n")
+
 def print_moves_table(moves):
     """
     Given the candidate moves list from the API (each a dict), print a nicely formatted table
@@ -188,9 +377,8 @@ def print_moves_table(moves):
     """
     header = (f"{'Move':<12} {'White':>10} {'Draws':>10} {'Black':>10} {'Total':>10} "
               f"{'W%':>8} {'D%':>8} {'B%':>8}")
-    print("\nCandidate Moves:")
-    print(header)
-    print("-" * len(header))
+    # Collect every line and write the table in one call.
+    lines = ["\nCandidate Moves:", header, "-" * len(header)]
     for m in moves:
         move_str = m.get("san", m.get("uci", ""))
         w = m.get("white", 0)
@@ -203,8 +391,8 @@ def print_moves_table(moves):
             bp = b / tot * 100
         else:
             wp = dp = bp = 0
-        print(f"{move_str:<12} {w:10} {d:10} {b:10} {tot:10} "
-              f"{wp:7.1f}% {dp:7.1f}% {bp:7.1f}%")
+        lines.append(TABLE_ROW(move_str, w, d, b, tot, wp, dp, bp))
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -217,28 +405,31 @@ def main():
     parser.add_argument('-e', '--elo', required=True,
                         help="Comma separated ELO brackets (e.g. 1200,1400,1600,1800)")
     args = parser.parse_args()
+    brackets = parse_elo_brackets(args.elo)
+    if not brackets:
+        parser.error("argument -e/--elo: expected at least one ELO bracket (e.g. 1600,1800)")
 
     try:
-        white_book = load_white_repertoire(args.white)
-        black_book = load_black_repertoire(args.black)
+        white_book = load_repertoire_cached(load_white_repertoire, args.white)
+        black_book = load_repertoire_cached(load_black_repertoire, args.black)
     except Exception as ex:
         print("Error loading PGN files:", ex)
         return
 
-    board, san_sequence = simulate_opening(white_book, black_book)
+    board, moves_played = simulate_opening(white_book, black_book)
     fen = board.fen()
     print("White:", args.white)
     print("Black:", args.black)
     print("FEN:", fen)
 
-    if san_sequence:
+    if moves_played:
         print("\nMoves played to reach this position:")
-        print(format_san_sequence(san_sequence))
+        print(format_san_sequence(to_san_sequence(moves_played)))
     else:
         print("\nNo moves were played (empty book?)")
 
     # If the final move delivered mate, force the stats.
-    if board.is_checkmate():
+    if board.is_check() and board.is_checkmate():
         if board.turn == chess.WHITE:
             # White is to move but is mated: Black delivered mate.
             white_wins, draws, black_wins = 0, 0, 1
@@ -251,11 +442,11 @@ def main():
         print("\n(Mate reached; no candidate moves table available.)")
     else:
         try:
-            white_wins, draws, black_wins, total, api_data = query_lichess(
-                fen, args.elo.replace(" ", ""))
+            bracket_results = query_lichess_brackets(board, brackets)
         except Exception as e:
             print("API request failed:", e)
             return
+        white_wins, draws, black_wins, total, api_data = combine_bracket_results(bracket_results)
 
         if total > 0:
             overall_wp = white_wins / total * 100
@@ -267,6 +458,7 @@ def main():
         print("\nOverall Result from Lichess Explorer:")
         print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
               f"{overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
+        print_bracket_table(bracket_results)
 
         moves = api_data.get("moves", [])
         if moves:
@@ -1,104 +1,224 @@
 #!/usr/bin/env python3
 import argparse
+import io
+import functools
 import chess
 import chess.pgn
+import chess.polyglot
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+import sys
 
 #########################
 # TREE BUILDING FUNCTIONS
 #########################
 
+_ZOBRIST_ARRAY = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_ZOBRIST_HASHER = chess.polyglot.ZobristHasher(_ZOBRIST_ARRAY)
+
+def zobrist_piece(piece_type, color, square):
+    """Zobrist term for one piece on one square (polyglot layout)."""
+    return _ZOBRIST_ARRAY[64 * ((piece_type - 1) * 2 + color) + square]
+
+def zobrist_state(board):
+    """Zobrist terms for castling rights, en passant file and side to move."""
+    return (_ZOBRIST_HASHER.hash_castling(board) ^ _ZOBRIST_HASHER.hash_ep_square(board) ^
+            _ZOBRIST_HASHER.hash_turn(board))
+
+def push_with_key(board, move, key):
+    """
+    Push move onto board and return the new position's Zobrist key, updated from key
+    (the key before the move) by XORing out/in only the pieces and state the move changes.
+    Equal to chess.polyglot.zobrist_hash(board) after the push.
+    """
+    if not move:
+        board.push(move)
+        return chess.polyglot.zobrist_hash(board)
+    color = board.turn
+    piece_type = board.piece_type_at(move.from_square)
+    key ^= zobrist_state(board) ^ zobrist_piece(piece_type, color, move.from_square)
+    if board.is_castling(move):
+        back_rank = 0 if color == chess.WHITE else 56
+        kingside = board.is_kingside_castling(move)
+        if board.rooks & board.occupied_co[color] & chess.BB_SQUARES[move.to_square]:
+            rook_from = move.to_square  # king-takes-rook encoding (Chess960)
+        else:
+            rook_from = back_rank + 7 if kingside else back_rank
+        # The king and rook land on the g/f (kingside) or c/d (queenside) files in either variant.
+        king_to, rook_to = (back_rank + 6, back_rank + 5) if kingside else (back_rank + 2, back_rank + 3)
+        key ^= (zobrist_piece(chess.KING, color, king_to) ^
+                zobrist_piece(chess.ROOK, color, rook_from) ^ zobrist_piece(chess.ROOK, color, rook_to))
+    else:
+        captured_type = board.piece_type_at(move.to_square)
+        if captured_type:
+            key ^= zobrist_piece(captured_type, not color, move.to_square)
+        elif piece_type == chess.PAWN and board.is_en_passant(move):
+            captured_square = move.to_square - 8 if color == chess.WHITE else move.to_square + 8
+            key ^= zobrist_piece(chess.PAWN, not color, captured_square)
+        key ^= zobrist_piece(move.promotion or piece_type, color, move.to_square)
+    board.push(move)
+    return key ^ zobrist_state(board)
+
+# One shared chess.Move object per distinct move, so trees built from many games
+# do not keep a separate copy of e.g. e2e4 for every position it is played from.
+_MOVE_POOL = {}
+
+def intern_move(move):
+    """Return the pooled chess.Move equal to move (adding move to the pool if new)."""
+    return _MOVE_POOL.setdefault(move, move)
+
+def open_pgn(filename):
+    """
+    Open a PGN file for chess.pgn.read_game: a buffered binary read decoded as UTF-8
+    (undecodable bytes replaced), without universal-newline translation (the PGN
+    parser handles CRLF itself).
+    """
+    return io.TextIOWrapper(open(filename, 'rb'), encoding='utf-8', errors='replace', newline='\n')
+
+class MainlineMoves(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records only a game's mainline moves.
+    Variations are skipped and comments/NAGs ignored, so no Game/ChildNode tree is built.
+    """
+    def begin_game(self):
+        self.moves = []
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
+
 class RepertoireTree:
     def __init__(self):
-        # The tree is a dictionary mapping a FEN string to a dictionary of moves.
-        # For a given FEN, tree[fen] is a dict: { move_uci: new_fen, ... }
+        # The tree is a dictionary mapping a position's Zobrist hash to a list of moves.
+        # For a given key, tree[key] is a list: [ chess.Move, ... ] in order of first appearance.
         self.tree = {}
+        # The first move recorded for each key (tree[key][0]), for one-probe lookups.
+        self.first = {}
+        # Key reached by each (key, move) edge already replayed, so shared prefixes
+        # across games are neither rehashed nor replayed.
+        self.child_keys = {}
     
-    def add_line(self, game, side="white"):
+    def add_line(self, game, side="white", board=None):
         """
         Adds one game (variation) from the PGN into the tree.
         For 'white', only record moves when board.turn==White.
         For 'black', only record moves when board.turn==Black.
+        If a board is given it is reset and reused to replay the game.
         """
-        board = chess.Board()
-        for move in game.mainline_moves():
-            if (side == "white" and board.turn == chess.WHITE) or (side == "black" and board.turn == chess.BLACK):
-                fen = board.fen()
-                uci_move = move.uci()
-                board.push(move)
-                new_fen = board.fen()
-                if fen not in self.tree:
-                    self.tree[fen] = {}
-                if uci_move not in self.tree[fen]:
-                    self.tree[fen][uci_move] = new_fen
+        if board is None:
+            board = chess.Board()
+        else:
+            board.reset()
+        key = chess.polyglot.zobrist_hash(board)
+        tree = self.tree
+        child_keys = self.child_keys
+        # Games start from the initial position, so the recorded side simply alternates.
+        recording = side == "white"
+        # Moves along already-known edges are only pushed onto the board once an
+        # unknown edge needs it for push_with_key.
+        pending = []
+        for move in game.moves:
+            if recording:
+                moves = tree.setdefault(key, [])
+                if move not in moves:
+                    move = intern_move(move)
+                    if not moves:
+                        self.first[key] = move
+                    moves.append(move)
+            recording = not recording
+            child_key = child_keys.get((key, move))
+            if child_key is None:
+                for pending_move in pending:
+                    board.push(pending_move)
+                pending.clear()
+                child_key = child_keys[(key, move)] = push_with_key(board, move, key)
             else:
-                board.push(move)
+                pending.append(move)
+            key = child_key
     
     def build_from_file(self, filename, side="white"):
-        with open(filename, 'r') as pgn_file:
+        board = chess.Board()  # reused for every game
+        with open_pgn(filename) as pgn_file:
             while True:
-                game = chess.pgn.read_game(pgn_file)
+                game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
                 if game is None:
                     break
-                self.add_line(game, side=side)
+                self.add_line(game, side=side, board=board)
         logging.debug(f"Built {side} tree with {len(self.tree)} nodes.")
 
-    def get_next_move(self, fen):
-        """Return a candidate move (as UCI string) for the given fen, or None if not found."""
-        if fen in self.tree and self.tree[fen]:
-            # Return the first candidate (dictionary iteration order)
-            return list(self.tree[fen].keys())[0]
-        return None
+    def get_next_move(self, key):
+        """Return a candidate move (as chess.Move) for the given position key, or None if not found."""
+        # The first candidate (insertion order)
+        return self.first.get(key)
 
 #########################
 # SIMULATION FUNCTION
 #########################
 
+SIDE_NAMES = {chess.WHITE: "White", chess.BLACK: "Black"}
+
 def simulate_opening_tree(white_tree, black_tree):
     """
     Simulate the opening battle using the repertoire trees.
-    At each turn, the current board's FEN is used to look up the next move.
-    Returns a tuple (board, san_sequence) where san_sequence is the list of moves in SAN.
+    At each turn, the current board's Zobrist hash is used to look up the next move.
+    The hash ignores the move counters, so when a position repeats, the side to move is
+    treated as out-of-book instead of replaying the same line forever.
+    Returns a tuple (board, moves_played) where moves_played is the list of chess.Move
+    objects in the order they were played. SAN is not computed here; see to_san_sequence.
     """
     board = chess.Board()
-    san_sequence = []
+    current_key = chess.polyglot.zobrist_hash(board)
+    moves_played = []
+    seen_keys = set()
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)  # checked once, not per ply
+    trees = {chess.WHITE: white_tree, chess.BLACK: black_tree}
     
     while True:
-        current_fen = board.fen()
-        if board.turn == chess.WHITE:
-            candidate = white_tree.get_next_move(current_fen)
-            if candidate is None:
-                logging.debug(f"White out-of-book at FEN: {current_fen}")
-                break
-            move = chess.Move.from_uci(candidate)
-            if move not in board.legal_moves:
-                logging.debug(f"White candidate {candidate} illegal at FEN: {current_fen}")
-                break
-            san = board.san(move)
-            san_sequence.append(san)
-            board.push(move)
-            logging.debug(f"White plays {candidate} ({san}); New FEN: {board.fen()}")
-        else:
-            candidate = black_tree.get_next_move(current_fen)
-            if candidate is None:
-                logging.debug(f"Black out-of-book at FEN: {current_fen}")
-                break
-            move = chess.Move.from_uci(candidate)
-            if move not in board.legal_moves:
-                logging.debug(f"Black candidate {candidate} illegal at FEN: {current_fen}")
-                break
-            san = board.san(move)
-            san_sequence.append(san)
-            board.push(move)
-            logging.debug(f"Black plays {candidate} ({san}); New FEN: {board.fen()}")
-    logging.debug(f"Final move sequence: {format_san_sequence(san_sequence)}")
-    return board, san_sequence
+        side = SIDE_NAMES[board.turn]
+        if current_key in seen_keys:
+            logging.debug(f"{side} out-of-book at repeated FEN: {board.fen()}")
+            break
+        seen_keys.add(current_key)
+        move = trees[board.turn].get_next_move(current_key)
+        if move is None:
+            logging.debug(f"{side} out-of-book at FEN: {board.fen()}")
+            break
+        if not board.is_legal(move):
+            logging.debug(f"{side} candidate {move.uci()} illegal at FEN: {board.fen()}")
+            break
+        moves_played.append(move)
+        current_key = push_with_key(board, move, current_key)
+        if debug:
+            logging.debug(f"{side} plays {move.uci()}; New FEN: {board.fen()}")
+    return board, moves_played
 
 #########################
 # HELPER FUNCTIONS
 #########################
 
+def to_san_sequence(moves):
+    """
+    Replay the given moves on a fresh board and return them as a list of SAN strings.
+    Only called when the moves are actually printed, since SAN needs legal-move generation.
+    """
+    board = chess.Board()
+    san_sequence = []
+    for move in moves:
+        san_sequence.append(board.san(move))
+        board.push(move)
+    return san_sequence
+
 def format_san_sequence(san_seq):
     """
     Given a list of SAN half-moves, produce a single string with move numbers.
@@ -106,24 +226,25 @@ def format_san_sequence(san_seq):
       "1.e4 e5 2.Nf3 Nc6"
     (No space after the move number.)
     """
-    moves = []
-    move_num = 1
-    i = 0
-    while i < len(san_seq):
-        if i + 1 < len(san_seq):
-            moves.append(f"{move_num}.{san_seq[i]} {san_seq[i+1]}")
-            i += 2
-        else:
-            moves.append(f"{move_num}.{san_seq[i]}")
-            i += 1
-        move_num += 1
+    pairs = zip(san_seq[0::2], san_seq[1::2])
+    moves = [f"{move_num}.{white} {black}" for move_num, (white, black) in enumerate(pairs, 1)]
+    if len(san_seq) % 2:
+        moves.append(f"{len(san_seq) // 2 + 1}.{san_seq[-1]}")
     return " ".join(moves)
 
+# Shared session: keep-alive, connection pooling and retries for Lichess Explorer calls.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+
+@functools.lru_cache(maxsize=4096)
 def query_lichess(fen, ratings):
     """
     Query the Lichess Explorer API using the given FEN and ratings string.
     Returns a tuple: (white_wins, draws, black_wins, total, api_data)
     where api_data is the full JSON response.
+    Results are memoized per (fen, ratings); the cached api_data must not be modified.
     """
     params = {
         "variant": "standard",
@@ -132,7 +253,7 @@ def query_lichess(fen, ratings):
         "fen": fen
     }
     api_url = "https://explorer.lichess.ovh/lichess"
-    response = requests.get(api_url, params=params)
+    response = _SESSION.get(api_url, params=params)
     response.raise_for_status()
     data = response.json()
     white_wins = data.get("white", 0)
@@ -141,6 +262,9 @@ def query_lichess(fen, ratings):
     total = white_wins + draws + black_wins
     return white_wins, draws, black_wins, total, data
 
+# Row layout of the candidate moves table, bound once so the format spec is parsed once.
+TABLE_ROW = "{:<12} {:10} {:10} {:10} {:10} {:7.1f}% {:7.1f}% {:7.1f}%".format
+
 def print_moves_table(moves):
     """
     Given the candidate moves list from the API (each a dict), print a formatted table
@@ -148,23 +272,17 @@ def print_moves_table(moves):
     """
     header = (f"{'Move':<12} {'White':>10} {'Draws':>10} {'Black':>10} {'Total':>10} "
               f"{'W%':>8} {'D%':>8} {'B%':>8}")
-    print("\nCandidate Moves:")
-    print(header)
-    print("-" * len(header))
+    lines = ["\nCandidate Moves:", header, "-" * len(header)]
     for m in moves:
         move_str = m.get("san", m.get("uci", ""))
         w = m.get("white", 0)
         d = m.get("draws", 0)
         b = m.get("black", 0)
         tot = w + d + b
-        if tot > 0:
-            wp = w / tot * 100
-            dp = d / tot * 100
-            bp = b / tot * 100
-        else:
-            wp = dp = bp = 0
-        print(f"{move_str:<12} {w:10} {d:10} {b:10} {tot:10} "
-              f"{wp:7.1f}% {dp:7.1f}% {bp:7.1f}%")
+        # One division per row; the three percentages are multiplications.
+        scale = 100 / tot if tot > 0 else 0
+        lines.append(TABLE_ROW(move_str, w, d, b, tot, w * scale, d * scale, b * scale))
+    sys.stdout.write("\n".join(lines) + "\n")
 
 #########################
 # MAIN FUNCTION
@@ -201,14 +319,14 @@ def main():
     black_tree.build_from_file(args.black, side="black")
 
     # Simulate the opening battle.
-    board, san_sequence = simulate_opening_tree(white_tree, black_tree)
+    board, moves_played = simulate_opening_tree(white_tree, black_tree)
     fen = board.fen()
     print("White:", args.white)
     print("Black:", args.black)
     print("FEN:", fen)
 
-    if san_sequence:
-        san_moves = format_san_sequence(san_sequence)
+    if moves_played:
+        san_moves = format_san_sequence(to_san_sequence(moves_played))
         print("\nMoves played to reach this position:")
         print(san_moves)
         logging.debug(f"Moves played: {san_moves}")
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 import argparse
+import io
+import functools
 import chess
 import chess.pgn
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+import sys
 
 def setup_logging(verbose):
     if verbose:
@@ -14,157 +19,140 @@ def setup_logging(verbose):
     else:
         logging.basicConfig(level=logging.WARNING)
 
+# One shared chess.Move object per distinct move, so trees built from many games
+# do not keep a separate copy of e.g. e2e4 for every position it is played from.
+_MOVE_POOL = {}
+
+def intern_move(move):
+    return _MOVE_POOL.setdefault(move, move)
+
+def open_pgn(filename):
+    # Buffered binary read decoded as UTF-8 (undecodable bytes replaced), without
+    # universal-newline translation (the PGN parser handles CRLF itself).
+    return io.TextIOWrapper(open(filename, 'rb'), encoding='utf-8', errors='replace', newline='\n')
+
+# PGN visitor that records only a game's mainline moves (no Game/ChildNode tree is built).
+class MainlineMoves(chess.pgn.BaseVisitor):
+    def begin_game(self):
+        self.moves = []
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
+
 def load_white_repertoire(filename):
-    white_lines = []
-    with open(filename, 'r') as pgn_file:
+    # Trie keyed by White's own moves: { white_move: { next white_move: {...}, ... }, ... }.
+    # A node's keys are White's candidates after the White moves leading to it, in
+    # first-seen order, so a line applies whatever Black replied.
+    white_trie = {}
+    game_count = 0
+    with open_pgn(filename) as pgn_file:
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
             if game is None:
                 break
-            board = chess.Board()
-            line = []
-            for move in game.mainline_moves():
-                if board.turn == chess.WHITE:
-                    line.append(move.uci())
-                board.push(move)
-            if line:
-                white_lines.append(line)
-            logging.debug(f"Loaded white line: {line}")
-    if not white_lines:
+            game_count += 1
+            node = white_trie
+            for move in game.moves[0::2]:
+                node = node.setdefault(intern_move(move), {})
+    if not white_trie:
         raise ValueError(f"No games found in white PGN file: {filename}")
-    logging.debug(f"Total white variations loaded: {len(white_lines)}")
-    return white_lines
+    logging.debug(f"Total white variations loaded: {game_count}")
+    return white_trie
 
 def load_black_repertoire(filename):
-    black_lines = []
-    with open(filename, 'r') as pgn_file:
+    # Trie keyed by the moves of both sides in the order they were played. After a
+    # White move, a node's keys are Black's replies in games following exactly that sequence.
+    black_trie = {}
+    game_count = 0
+    with open_pgn(filename) as pgn_file:
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
             if game is None:
                 break
-            board = chess.Board()
-            white_line = []
-            black_line = []
-            for move in game.mainline_moves():
-                if board.turn == chess.WHITE:
-                    white_line.append(move.uci())
-                else:
-                    black_line.append(move.uci())
-                board.push(move)
-            if white_line or black_line:
-                black_lines.append({
-                    'white_moves': white_line,
-                    'black_moves': black_line
-                })
-            logging.debug(f"Loaded black game: white_moves={white_line}, black_moves={black_line}")
-    if not black_lines:
+            node = black_trie
+            for move in game.moves:
+                node = node.setdefault(intern_move(move), {})
+            if game.moves:
+                game_count += 1
+    if not game_count:
         raise ValueError(f"No games found in black PGN file: {filename}")
-    logging.debug(f"Total black games loaded: {len(black_lines)}")
-    return black_lines
+    logging.debug(f"Total black games loaded: {game_count}")
+    return black_trie
+
+SIDE_NAMES = {chess.WHITE: "White", chess.BLACK: "Black"}
 
-def simulate_opening(white_book, black_book):
+def simulate_opening(white_trie, black_trie):
     board = chess.Board()
-    played_white = []  # white moves played so far (as UCI strings)
-    san_sequence = []  # moves recorded in SAN
+    moves_played = []  # moves in the order they were played
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)  # checked once, not per ply
 
-    current_white_book = white_book[:]
-    current_black_book = black_book[:]
+    # Current trie node of each book; each side's candidates are its node's keys.
+    nodes = {chess.WHITE: white_trie, chess.BLACK: black_trie}
 
-    move_count = 0
     while True:
-        move_count += 1
-        # WHITE'S TURN:
-        white_candidates = []
-        for variation in current_white_book:
-            if len(variation) > len(played_white) and variation[:len(played_white)] == played_white:
-                white_candidates.append(variation[len(played_white)])
-        logging.debug(f"After {move_count-1} full moves, White candidates: {white_candidates}")
-        if not white_candidates:
-            logging.debug("White is out-of-book.")
+        color = board.turn
+        side = SIDE_NAMES[color]
+        candidates = nodes[color]
+        if debug:
+            logging.debug(f"After {(len(moves_played) + 1) // 2} full moves, {side} candidates: {list(candidates)}")
+        if not candidates:
+            logging.debug(f"{side} is out-of-book.")
             break
 
-        # Try all white candidates until one is legal.
-        white_move_uci = None
-        for candidate in white_candidates:
-            try:
-                move = chess.Move.from_uci(candidate)
-            except Exception as e:
-                logging.debug(f"Error converting white candidate {candidate}: {e}")
-                continue
-            if move in board.legal_moves:
-                white_move_uci = candidate
+        # Try all candidates until one is legal.
+        move = None
+        for candidate in candidates:
+            if board.is_legal(candidate):
+                move = candidate
                 break
             else:
-                logging.debug(f"Candidate white move {candidate} is illegal in current position.")
-        if white_move_uci is None:
-            logging.debug("No legal white candidate move found; White is out-of-book.")
+                if debug:
+                    logging.debug(f"Candidate {side.lower()} move {candidate.uci()} is illegal in current position.")
+        if move is None:
+            logging.debug(f"No legal {side.lower()} candidate move found; {side} is out-of-book.")
             break
-        move = chess.Move.from_uci(white_move_uci)
-        san = board.san(move)
-        san_sequence.append(san)
+        moves_played.append(move)
         board.push(move)
-        played_white.append(white_move_uci)
-        logging.debug(f"White plays {white_move_uci} ({san}); Board FEN: {board.fen()}")
-        before = len(current_white_book)
-        current_white_book = [variation for variation in current_white_book
-                              if len(variation) > len(played_white) and variation[:len(played_white)] == played_white]
-        logging.debug(f"Pruned white_book from {before} to {len(current_white_book)} variations.")
-
-        # BLACK'S TURN:
-        black_candidates = []
-        for game in current_black_book:
-            if len(game['white_moves']) >= len(played_white) and game['white_moves'][:len(played_white)] == played_white:
-                reply_index = len(played_white) - 1
-                if len(game['black_moves']) > reply_index:
-                    black_candidates.append(game['black_moves'][reply_index])
-        logging.debug(f"After {move_count} full moves, Black candidates: {black_candidates}")
-        if not black_candidates:
-            logging.debug("Black is out-of-book.")
-            break
+        # White's trie only follows White's moves; Black's follows both sides'.
+        if color == chess.WHITE:
+            nodes[chess.WHITE] = candidates[move]
+        nodes[chess.BLACK] = nodes[chess.BLACK].get(move, {})
+        if debug:
+            logging.debug(f"{side} plays {move.uci()}; Board FEN: {board.fen()}")
+    return board, moves_played
 
-        # Try all black candidates until one is legal.
-        black_move_uci = None
-        for candidate in black_candidates:
-            try:
-                move = chess.Move.from_uci(candidate)
-            except Exception as e:
-                logging.debug(f"Error converting black candidate {candidate}: {e}")
-                continue
-            if move in board.legal_moves:
-                black_move_uci = candidate
-                break
-            else:
-                logging.debug(f"Candidate black move {candidate} is illegal in current position.")
-        if black_move_uci is None:
-            logging.debug("No legal black candidate move found; Black is out-of-book.")
-            break
-        move = chess.Move.from_uci(black_move_uci)
-        san = board.san(move)
-        san_sequence.append(san)
+def to_san_sequence(moves):
+    board = chess.Board()
+    san_sequence = []
+    for move in moves:
+        san_sequence.append(board.san(move))
         board.push(move)
-        logging.debug(f"Black plays {black_move_uci} ({san}); Board FEN: {board.fen()}")
-        before = len(current_black_book)
-        current_black_book = [game for game in current_black_book 
-                              if len(game['black_moves']) > (len(played_white)-1) and 
-                              game['black_moves'][len(played_white)-1] == black_move_uci]
-        logging.debug(f"Pruned black_book from {before} to {len(current_black_book)} games.")
-    logging.debug(f"Moves played: {format_san_sequence(san_sequence)}")
-    return board, san_sequence
+    return san_sequence
 
 def format_san_sequence(san_seq):
-    moves = []
-    move_num = 1
-    i = 0
-    while i < len(san_seq):
-        if i + 1 < len(san_seq):
-            moves.append(f"{move_num}.{san_seq[i]} {san_seq[i+1]}")
-            i += 2
-        else:
-            moves.append(f"{move_num}.{san_seq[i]}")
-            i += 1
-        move_num += 1
+    pairs = zip(san_seq[0::2], san_seq[1::2])
+    moves = [f"{move_num}.{white} {black}" for move_num, (white, black) in enumerate(pairs, 1)]
+    if len(san_seq) % 2:
+        moves.append(f"{len(san_seq) // 2 + 1}.{san_seq[-1]}")
     return " ".join(moves)
 
+# Shared session: keep-alive, connection pooling and retries for Lichess Explorer calls.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+
+@functools.lru_cache(maxsize=4096)
 def query_lichess(fen, ratings):
     params = {
         "variant": "standard",
@@ -173,7 +161,7 @@ def query_lichess(fen, ratings):
         "fen": fen
     }
     api_url = "https://explorer.lichess.ovh/lichess"
-    response = requests.get(api_url, params=params)
+    response = _SESSION.get(api_url, params=params)
     response.raise_for_status()
     data = response.json()
     white_wins = data.get("white", 0)
@@ -182,26 +170,23 @@ def query_lichess(fen, ratings):
     total = white_wins + draws + black_wins
     return white_wins, draws, black_wins, total, data
 
+# Row layout of the candidate moves table, bound once so the format spec is parsed once.
+TABLE_ROW = "{:<12} {:10} {:10} {:10} {:10} {:7.1f}% {:7.1f}% {:7.1f}%".format
+
 def print_moves_table(moves):
     header = (f"{'Move':<12} {'White':>10} {'Draws':>10} {'Black':>10} {'Total':>10} "
               f"{'W%':>8} {'D%':>8} {'B%':>8}")
-    print("\nCandidate Moves:")
-    print(header)
-    print("-" * len(header))
+    lines = ["\nCandidate Moves:", header, "-" * len(header)]
     for m in moves:
         move_str = m.get("san", m.get("uci", ""))
         w = m.get("white", 0)
         d = m.get("draws", 0)
         b = m.get("black", 0)
         tot = w + d + b
-        if tot > 0:
-            wp = w / tot * 100
-            dp = d / tot * 100
-            bp = b / tot * 100
-        else:
-            wp = dp = bp = 0
-        print(f"{move_str:<12} {w:10} {d:10} {b:10} {tot:10} "
-              f"{wp:7.1f}% {dp:7.1f}% {bp:7.1f}%")
+        # One division per row; the three percentages are multiplications.
+        scale = 100 / tot if tot > 0 else 0
+        lines.append(TABLE_ROW(move_str, w, d, b, tot, w * scale, d * scale, b * scale))
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -219,21 +204,21 @@ def main():
     logging.debug("Starting Opening Arena simulation.")
 
     try:
-        white_book = load_white_repertoire(args.white)
-        black_book = load_black_repertoire(args.black)
+        white_tree = load_white_repertoire(args.white)
+        black_tree = load_black_repertoire(args.black)
     except Exception as ex:
         logging.debug(f"Error loading PGN files: {ex}")
         print("Error loading PGN files:", ex)
         return
 
-    board, san_sequence = simulate_opening(white_book, black_book)
+    board, moves_played = simulate_opening(white_tree, black_tree)
     fen = board.fen()
     print("White:", args.white)
     print("Black:", args.black)
     print("FEN:", fen)
 
-    if san_sequence:
-        san_moves = format_san_sequence(san_sequence)
+    if moves_played:
+        san_moves = format_san_sequence(to_san_sequence(moves_played))
         print("\nMoves played to reach this position:")
         print(san_moves)
         logging.debug(f"Moves played: {san_moves}")
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import argparse
+import io
 import chess
 import chess.pgn
+import chess.polyglot
 import logging
 
 def setup_logging(verbose):
@@ -13,39 +15,120 @@ def setup_logging(verbose):
     else:
         logging.basicConfig(level=logging.WARNING)
 
+_ZOBRIST_ARRAY = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_ZOBRIST_HASHER = chess.polyglot.ZobristHasher(_ZOBRIST_ARRAY)
+
+def zobrist_piece(piece_type, color, square):
+    """Zobrist term for one piece on one square (polyglot layout)."""
+    return _ZOBRIST_ARRAY[64 * ((piece_type - 1) * 2 + color) + square]
+
+def zobrist_state(board):
+    """Zobrist terms for castling rights, en passant file and side to move."""
+    return (_ZOBRIST_HASHER.hash_castling(board) ^ _ZOBRIST_HASHER.hash_ep_square(board) ^
+            _ZOBRIST_HASHER.hash_turn(board))
+
+def push_with_key(board, move, key):
+    """
+    Push move onto board and return the new position's Zobrist key, updated from key
+    (the key before the move) by XORing out/in only the pieces and state the move changes.
+    Equal to chess.polyglot.zobrist_hash(board) after the push.
+    """
+    if not move:
+        board.push(move)
+        return chess.polyglot.zobrist_hash(board)
+    color = board.turn
+    piece_type = board.piece_type_at(move.from_square)
+    key ^= zobrist_state(board) ^ zobrist_piece(piece_type, color, move.from_square)
+    if board.is_castling(move):
+        back_rank = 0 if color == chess.WHITE else 56
+        kingside = board.is_kingside_castling(move)
+        if board.rooks & board.occupied_co[color] & chess.BB_SQUARES[move.to_square]:
+            rook_from = move.to_square  # king-takes-rook encoding (Chess960)
+        else:
+            rook_from = back_rank + 7 if kingside else back_rank
+        # The king and rook land on the g/f (kingside) or c/d (queenside) files in either variant.
+        king_to, rook_to = (back_rank + 6, back_rank + 5) if kingside else (back_rank + 2, back_rank + 3)
+        key ^= (zobrist_piece(chess.KING, color, king_to) ^
+                zobrist_piece(chess.ROOK, color, rook_from) ^ zobrist_piece(chess.ROOK, color, rook_to))
+    else:
+        captured_type = board.piece_type_at(move.to_square)
+        if captured_type:
+            key ^= zobrist_piece(captured_type, not color, move.to_square)
+        elif piece_type == chess.PAWN and board.is_en_passant(move):
+            captured_square = move.to_square - 8 if color == chess.WHITE else move.to_square + 8
+            key ^= zobrist_piece(chess.PAWN, not color, captured_square)
+        key ^= zobrist_piece(move.promotion or piece_type, color, move.to_square)
+    board.push(move)
+    return key ^ zobrist_state(board)
+
+# One shared chess.Move object per distinct move, so trees built from many games
+# do not keep a separate copy of e.g. e2e4 for every position it is played from.
+_MOVE_POOL = {}
+
+def intern_move(move):
+    """Return the pooled chess.Move equal to move (adding move to the pool if new)."""
+    return _MOVE_POOL.setdefault(move, move)
+
+def open_pgn(filename):
+    """
+    Open a PGN file for chess.pgn.read_game: a buffered binary read decoded as UTF-8
+    (undecodable bytes replaced), without universal-newline translation (the PGN
+    parser handles CRLF itself).
+    """
+    return io.TextIOWrapper(open(filename, 'rb'), encoding='utf-8', errors='replace', newline='\n')
+
+class MainlineMoves(chess.pgn.BaseVisitor):
+    """
+    PGN visitor that records only a game's mainline moves.
+    Variations are skipped and comments/NAGs ignored, so no Game/ChildNode tree is built.
+    """
+    def begin_game(self):
+        self.moves = []
+
+    def visit_move(self, board, move):
+        self.moves.append(move)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # Keep the moves parsed so far, as the default GameBuilder does.
+        pass
+
+    def result(self):
+        return self
+
 def build_white_tree(filename):
     """
     Build a trie (nested dictionary) from the white repertoire PGN file.
     
     For each game, starting from the initial board:
-      - When it’s White’s turn, record the board state (FEN) as a key.
-      - Save White’s move (as UCI) as a branch, with the child being the new board FEN.
+      - When it’s White’s turn, record the board state (Zobrist hash) as a key.
+      - Save White’s move (as a chess.Move) in that key's list of moves.
     
     Returns a dictionary representing the tree.
     """
-    tree = {}  # tree: { fen: { white_move: child_fen, ... }, ... }
-    with open(filename, 'r') as pgn_file:
+    tree = {}  # tree: { key: [ white_move, ... ], ... }
+    board = chess.Board()  # reused for every game
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)  # checked once, not per move
+    with open_pgn(filename) as pgn_file:
         game_count = 0
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
             if game is None:
                 break
             game_count += 1
-            board = chess.Board()
-            for move in game.mainline_moves():
+            board.reset()
+            key = chess.polyglot.zobrist_hash(board)
+            for move in game.moves:
                 if board.turn == chess.WHITE:
-                    fen = board.fen()
-                    white_move = move.uci()
-                    new_board = board.copy()
-                    new_board.push(move)
-                    child_fen = new_board.fen()
-                    if fen not in tree:
-                        tree[fen] = {}
-                    # If the same move appears in different games, we simply record the resulting FEN
-                    if white_move not in tree[fen]:
-                        tree[fen][white_move] = child_fen
-                    logging.debug(f"White tree: At FEN '{fen}', added move '{white_move}' -> '{child_fen}'")
-                board.push(move)
+                    moves = tree.setdefault(key, [])
+                    # If the same move appears in different games, we record it only once
+                    if move not in moves:
+                        moves.append(intern_move(move))
+                    if debug:
+                        logging.debug(f"White tree: At key {key:016x}, added move '{move.uci()}'")
+                key = push_with_key(board, move, key)
         logging.debug(f"White repertoire: Loaded {game_count} games with {len(tree)} unique positions.")
     return tree
 
@@ -55,41 +138,75 @@ def build_black_tree(filename):
     
     For each game, starting from the initial board:
       - Play White’s move (to update the board) and then, when it’s Black’s turn, 
-        record the board state (FEN) after White’s move as a key.
-      - Save Black’s move (as UCI) as the branch, with the child being the new board FEN.
+        record the board state (Zobrist hash) after White’s move as a key.
+      - Save Black’s move (as a chess.Move) in that key's list of moves.
     
     Returns a dictionary representing the tree.
     """
-    tree = {}  # tree: { fen: { black_move: child_fen, ... }, ... }
-    with open(filename, 'r') as pgn_file:
+    tree = {}  # tree: { key: [ black_move, ... ], ... }
+    board = chess.Board()  # reused for every game
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)  # checked once, not per move
+    with open_pgn(filename) as pgn_file:
         game_count = 0
         while True:
-            game = chess.pgn.read_game(pgn_file)
+            game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
             if game is None:
                 break
             game_count += 1
-            board = chess.Board()
-            for move in game.mainline_moves():
+            board.reset()
+            key = chess.polyglot.zobrist_hash(board)
+            for move in game.moves:
                 if board.turn == chess.WHITE:
-                    board.push(move)
+                    key = push_with_key(board, move, key)
                 else:  # Black's turn: record the board state (after White's move) as key.
-                    fen = board.fen()
-                    black_move = move.uci()
-                    new_board = board.copy()
-                    new_board.push(move)
-                    child_fen = new_board.fen()
-                    if fen not in tree:
-                        tree[fen] = {}
-                    if black_move not in tree[fen]:
-                        tree[fen][black_move] = child_fen
-                    logging.debug(f"Black tree: At FEN '{fen}', added move '{black_move}' -> '{child_fen}'")
-                    board.push(move)
+                    moves = tree.setdefault(key, [])
+                    if move not in moves:
+                        moves.append(intern_move(move))
+                    if debug:
+                        logging.debug(f"Black tree: At key {key:016x}, added move '{move.uci()}'")
+                    key = push_with_key(board, move, key)
         logging.debug(f"Black repertoire: Loaded {game_count} games with {len(tree)} unique positions.")
     return tree
 
+def sample_boards(filename, keys):
+    """
+    Replay the PGN file's games until a board is found for each of the given keys.
+    Returns { key: board }. Only used to print readable FENs for the summary, since the
+    trees themselves keep just the Zobrist hash of each position.
+    """
+    wanted = set(keys)
+    boards = {}
+    board = chess.Board()
+    with open_pgn(filename) as pgn_file:
+        while wanted:
+            game = chess.pgn.read_game(pgn_file, Visitor=MainlineMoves)
+            if game is None:
+                break
+            board.reset()
+            key = chess.polyglot.zobrist_hash(board)
+            for move in game.moves:
+                if key in wanted:
+                    wanted.discard(key)
+                    boards[key] = board.copy(stack=False)
+                key = push_with_key(board, move, key)
+    return boards
+
+def print_tree_summary(title, tree, filename):
+    print(f"{title}:")
+    print(f"Total starting positions (keys): {len(tree)}")
+    entries = list(tree.items())[:5]
+    boards = sample_boards(filename, [key for key, _ in entries])
+    for key, moves in entries:
+        board = boards[key]
+        print(f"FEN: {board.fen()}")
+        for move in moves:
+            board.push(move)
+            print(f"  Move: {move.uci()} -> Child FEN: {board.fen()}")
+            board.pop()
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Phase 1: Load repertoires into tries keyed by board FEN."
+        description="Phase 1: Load repertoires into tries keyed by board position (Zobrist hash)."
     )
     parser.add_argument('-w', '--white', required=True, help="White repertoire PGN file")
     parser.add_argument('-b', '--black', required=True, help="Black repertoire PGN file")
@@ -104,18 +221,8 @@ def main():
     black_tree = build_black_tree(args.black)
 
     # For demonstration, print out summary info
-    print("White repertoire tree:")
-    print(f"Total starting positions (keys): {len(white_tree)}")
-    for fen, moves in list(white_tree.items())[:5]:
-        print(f"FEN: {fen}")
-        for move, child in moves.items():
-            print(f"  Move: {move} -> Child FEN: {child}")
-    print("\nBlack repertoire tree:")
-    print(f"Total starting positions (keys): {len(black_tree)}")
-    for fen, moves in list(black_tree.items())[:5]:
-        print(f"FEN: {fen}")
-        for move, child in moves.items():
-            print(f"  Move: {move} -> Child FEN: {child}")
+    print_tree_summary("White repertoire tree", white_tree, args.white)
+    print_tree_summary("\nBlack repertoire tree", black_tree, args.black)
 
 if __name__ == '__main__':
     main()
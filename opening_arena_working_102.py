@@ -36,7 +36,7 @@ def insert_game_white(tree, game):
             # If the move is already there, we leave it as is.
             if move_uci not in tree[fen]:
                 tree[fen][move_uci] = child_fen
-            logging.debug(f"White tree: At FEN '{fen}', added move '{move_uci}' -> '{child_fen}'")
+            logging.debug("White tree: At FEN '%s', added move '%s' -> '%s'", fen, move_uci, child_fen)
         else:
             board.push(move)
 
@@ -55,7 +55,7 @@ def build_white_tree(filename):
                 break
             game_count += 1
             insert_game_white(tree, game)
-    logging.debug(f"White repertoire: Loaded {game_count} games with {len(tree)} unique positions.")
+    logging.debug("White repertoire: Loaded %d games with %d unique positions.", game_count, len(tree))
     return tree
 
 def insert_game_black(tree, game):
@@ -77,7 +77,7 @@ def insert_game_black(tree, game):
                 tree[fen] = {}
             if move_uci not in tree[fen]:
                 tree[fen][move_uci] = child_fen
-            logging.debug(f"Black tree: At FEN '{fen}', added move '{move_uci}' -> '{child_fen}'")
+            logging.debug("Black tree: At FEN '%s', added move '%s' -> '%s'", fen, move_uci, child_fen)
     # End of game.
 
 def build_black_tree(filename):
@@ -95,7 +95,7 @@ def build_black_tree(filename):
                 break
             game_count += 1
             insert_game_black(tree, game)
-    logging.debug(f"Black repertoire: Loaded {game_count} games with {len(tree)} unique positions.")
+    logging.debug("Black repertoire: Loaded %d games with %d unique positions.", game_count, len(tree))
     return tree
 
 ##############################
@@ -123,30 +123,31 @@ def simulate_game(white_tree, black_tree):
                 candidate = list(white_tree[current_fen].keys())[0]
                 move = chess.Move.from_uci(candidate)
                 if move not in board.legal_moves:
-                    logging.debug(f"White candidate {candidate} illegal at FEN: {current_fen}")
+                    logging.debug("White candidate %s illegal at FEN: %s", candidate, current_fen)
                     break
                 san = board.san(move)
                 san_sequence.append(san)
                 board.push(move)
-                logging.debug(f"White plays {candidate} ({san}); New FEN: {board.fen()}")
+                logging.debug("White plays %s (%s); New FEN: %s", candidate, san, board.fen())
             else:
-                logging.debug(f"White out-of-book at FEN: {current_fen}")
+                logging.debug("White out-of-book at FEN: %s", current_fen)
                 break
         else:  # Black's turn
             if current_fen in black_tree and black_tree[current_fen]:
                 candidate = list(black_tree[current_fen].keys())[0]
                 move = chess.Move.from_uci(candidate)
                 if move not in board.legal_moves:
-                    logging.debug(f"Black candidate {candidate} illegal at FEN: {current_fen}")
+                    logging.debug("Black candidate %s illegal at FEN: %s", candidate, current_fen)
                     break
                 san = board.san(move)
                 san_sequence.append(san)
                 board.push(move)
-                logging.debug(f"Black plays {candidate} ({san}); New FEN: {board.fen()}")
+                logging.debug("Black plays %s (%s); New FEN: %s", candidate, san, board.fen())
             else:
-                logging.debug(f"Black out-of-book at FEN: {current_fen}")
+                logging.debug("Black out-of-book at FEN: %s", current_fen)
                 break
-    logging.debug(f"Final move sequence: {format_san_sequence(san_sequence)}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Final move sequence: %s", format_san_sequence(san_sequence))
     return board, san_sequence
 
 def format_san_sequence(san_seq):
@@ -254,7 +255,7 @@ def main():
         moves_played = format_san_sequence(san_sequence)
         print("\nMoves played to reach this position:")
         print(moves_played)
-        logging.debug(f"Moves played: {moves_played}")
+        logging.debug("Moves played: %s", moves_played)
     else:
         print("\nNo moves were played (empty repertoire?)")
         logging.debug("No moves were played.")
@@ -276,7 +277,7 @@ def main():
         try:
             white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, args.elo.replace(" ", ""))
         except Exception as e:
-            logging.debug(f"API request failed: {e}")
+            logging.debug("API request failed: %s", e)
             print("API request failed:", e)
             return
 
@@ -290,7 +291,7 @@ def main():
         print("\nOverall Result from Lichess Explorer:")
         print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
               f"{overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
-        logging.debug(f"Overall API result: {white_wins}/{draws}/{black_wins} = {total}")
+        logging.debug("Overall API result: %d/%d/%d = %d", white_wins, draws, black_wins, total)
 
         moves = api_data.get("moves", [])
         if moves:
@@ -42,7 +42,7 @@ def process_white_node(node, board, tree):
             new_board.push(move)
             child_fen = new_board.fen()
             tree.insert(key_fen, move_uci, child_fen)
-            logging.debug(f"White tree: At FEN '{key_fen}', added move '{move_uci}' -> '{child_fen}'")
+            logging.debug("White tree: At FEN '%s', added move '%s' -> '%s'", key_fen, move_uci, child_fen)
         board.push(move)
         process_white_node(variation, board, tree)
         board.pop()
@@ -58,7 +58,7 @@ def build_white_tree(filename):
             game_count += 1
             board = chess.Board()
             process_white_node(game, board, tree)
-    logging.debug(f"White repertoire: Loaded {game_count} games with {len(tree.tree)} unique positions.")
+    logging.debug("White repertoire: Loaded %d games with %d unique positions.", game_count, len(tree.tree))
     return tree
 
 def process_black_node(node, board, tree):
@@ -72,7 +72,7 @@ def process_black_node(node, board, tree):
             new_board.push(move)
             child_fen = new_board.fen()
             tree.insert(key_fen, move_uci, child_fen)
-            logging.debug(f"Black tree: At FEN '{key_fen}', added move '{move_uci}' -> '{child_fen}'")
+            logging.debug("Black tree: At FEN '%s', added move '%s' -> '%s'", key_fen, move_uci, child_fen)
         board.push(move)
         process_black_node(variation, board, tree)
         board.pop()
@@ -88,7 +88,7 @@ def build_black_tree(filename):
             game_count += 1
             board = chess.Board()
             process_black_node(game, board, tree)
-    logging.debug(f"Black repertoire: Loaded {game_count} games with {len(tree.tree)} unique positions.")
+    logging.debug("Black repertoire: Loaded %d games with %d unique positions.", game_count, len(tree.tree))
     return tree
 
 ##############################
@@ -109,30 +109,31 @@ def simulate_game(white_tree, black_tree):
                 candidate = list(white_tree.tree[current_fen].keys())[0]
                 move = chess.Move.from_uci(candidate)
                 if move not in board.legal_moves:
-                    logging.debug(f"White candidate {candidate} illegal at FEN: {current_fen}")
+                    logging.debug("White candidate %s illegal at FEN: %s", candidate, current_fen)
                     break
                 san = board.san(move)
                 san_sequence.append(san)
                 board.push(move)
-                logging.debug(f"White plays {candidate} ({san}); New FEN: {board.fen()}")
+                logging.debug("White plays %s (%s); New FEN: %s", candidate, san, board.fen())
             else:
-                logging.debug(f"White out-of-book at FEN: {current_fen}")
+                logging.debug("White out-of-book at FEN: %s", current_fen)
                 break
         else:
             if current_fen in black_tree.tree and black_tree.tree[current_fen]:
                 candidate = list(black_tree.tree[current_fen].keys())[0]
                 move = chess.Move.from_uci(candidate)
                 if move not in board.legal_moves:
-                    logging.debug(f"Black candidate {candidate} illegal at FEN: {current_fen}")
+                    logging.debug("Black candidate %s illegal at FEN: %s", candidate, current_fen)
                     break
                 san = board.san(move)
                 san_sequence.append(san)
                 board.push(move)
-                logging.debug(f"Black plays {candidate} ({san}); New FEN: {board.fen()}")
+                logging.debug("Black plays %s (%s); New FEN: %s", candidate, san, board.fen())
             else:
-                logging.debug(f"Black out-of-book at FEN: {current_fen}")
+                logging.debug("Black out-of-book at FEN: %s", current_fen)
                 break
-    logging.debug(f"Final move sequence: {format_san_sequence(san_sequence)}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Final move sequence: %s", format_san_sequence(san_sequence))
     return board, san_sequence
 
 def format_san_sequence(san_seq):
@@ -224,7 +225,7 @@ def main():
         moves_played = format_san_sequence(san_sequence)
         print("\nMoves played to reach this position:")
         print(moves_played)
-        logging.debug(f"Moves played: {moves_played}")
+        logging.debug("Moves played: %s", moves_played)
     else:
         print("\nNo moves were played (empty repertoire?)")
         logging.debug("No moves were played.")
@@ -245,7 +246,7 @@ def main():
         try:
             white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, args.elo.replace(" ", ""))
         except Exception as e:
-            logging.debug(f"API request failed: {e}")
+            logging.debug("API request failed: %s", e)
             print("API request failed:", e)
             return
 
@@ -259,7 +260,7 @@ def main():
         print("\nOverall Result from Lichess Explorer:")
         print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
               f"{overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
-        logging.debug(f"Overall API result: {white_wins}/{draws}/{black_wins} = {total}")
+        logging.debug("Overall API result: %d/%d/%d = %d", white_wins, draws, black_wins, total)
 
         moves = api_data.get("moves", [])
         if moves:
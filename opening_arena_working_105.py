@@ -167,7 +167,8 @@ def simulate_game(white_tree, black_tree):
             else:
                 logging.debug("Black out-of-book at FEN: %s", current_fen)
                 break
-    logging.debug("Final move sequence: %s", format_san_sequence(san_sequence))
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Final move sequence: %s", format_san_sequence(san_sequence))
     return board, san_sequence
 
 ##############################
@@ -215,15 +216,25 @@ def print_moves_table(moves, current_move_number, is_white_turn):
             wp = dp = bp = 0
         print(f"{move_str:<12}{w:10d}{d:10d}{b:10d}{tot:10d} {wp:7.1f}% {dp:7.1f}% {bp:7.1f}%")
 
-def print_results(final_fen, moves_played, candidate_moves, board):
-    print("White:", args.white)
-    print("Black:", args.black)
+def print_results(final_fen, moves_played_str, board, white_path, black_path, ratings):
+    """
+    Print the repertoire files, the final position and the moves played to reach it
+    (moves_played_str, already formatted; empty if none), then the mate result or the
+    Lichess Explorer statistics for the given ratings.
+    """
+    print("White:", white_path)
+    print("Black:", black_path)
     print("Final FEN:", final_fen)
+
     print("\nMoves played to reach this position:")
-    if moves_played:
-        print(format_san_sequence(moves_played))
+    if moves_played_str:
+        print(moves_played_str)
+        logging.debug("Moves played: %s", moves_played_str)
     else:
         print("(No moves played)")
+        logging.debug("No moves were played.")
+
+    # Phase 3: Query Lichess Explorer API or print mate result.
     if board.is_checkmate():
         if board.turn == chess.WHITE:
             white_wins, draws, black_wins = 0, 0, 1
@@ -233,14 +244,15 @@ def print_results(final_fen, moves_played, candidate_moves, board):
         print("\nResult (Mate):")
         print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
               f"{white_wins*100:.1f}%/{draws*100:.1f}%/{black_wins*100:.1f}%")
+        logging.debug("Mate reached; simulation ended.")
         print("\n(Mate reached; no candidate moves table available.)")
     else:
         try:
-            white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, args.elo.replace(" ", ""))
+            white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, ratings)
         except Exception as e:
             logging.debug("API request failed: %s", e)
             print("API request failed:", e)
-            return
+            sys.exit(1)
         if total > 0:
             overall_wp = white_wins / total * 100
             overall_dp = draws / total * 100
@@ -250,12 +262,13 @@ def print_results(final_fen, moves_played, candidate_moves, board):
         print("\nOverall Result from Lichess Explorer:")
         print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
               f"{overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
-        candidate_moves = api_data.get("moves", [])
-        if candidate_moves:
-            # Get current move number and whose turn from the final board state.
+        logging.debug("Overall API result: %d/%d/%d = %d", white_wins, draws, black_wins, total)
+        moves = api_data.get("moves", [])
+        if moves:
+            # Get current move number and turn from the board.
             current_move_number = board.fullmove_number
             is_white_turn = board.turn == chess.WHITE
-            print_moves_table(candidate_moves, current_move_number, is_white_turn)
+            print_moves_table(moves, current_move_number, is_white_turn)
             logging.debug("Candidate moves table printed.")
         else:
             print("No candidate moves available in the API response.")
@@ -265,7 +278,6 @@ def print_results(final_fen, moves_played, candidate_moves, board):
 # MAIN FUNCTION: PHASES 1, 2, & 3
 ##############################
 def main():
-    global args  # so that print_results() can use args.white and args.black
     parser = argparse.ArgumentParser(
         description="Opening Arena: Load repertoires (with variations), simulate a game, and query Lichess Explorer API."
     )
@@ -287,60 +299,10 @@ def main():
 
     # Phase 2: Simulate the game.
     board, san_sequence = simulate_game(white_tree, black_tree)
-    final_fen = board.fen()
-
-    # Print basic game info
-    print("White:", args.white)
-    print("Black:", args.black)
-    print("Final FEN:", final_fen)
+    moves_played_str = format_san_sequence(san_sequence) if san_sequence else ""
 
-    print("\nMoves played to reach this position:")
-    if san_sequence:
-        print(format_san_sequence(san_sequence))
-        logging.debug("Moves played: %s", format_san_sequence(san_sequence))
-    else:
-        print("(No moves played)")
-        logging.debug("No moves were played.")
-
-    # Phase 3: Query Lichess Explorer API or print mate result.
-    if board.is_checkmate():
-        if board.turn == chess.WHITE:
-            white_wins, draws, black_wins = 0, 0, 1
-        else:
-            white_wins, draws, black_wins = 1, 0, 0
-        total = 1
-        print("\nResult (Mate):")
-        print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
-              f"{white_wins*100:.1f}%/{draws*100:.1f}%/{black_wins*100:.1f}%")
-        logging.debug("Mate reached; simulation ended.")
-        print("\n(Mate reached; no candidate moves table available.)")
-    else:
-        try:
-            white_wins, draws, black_wins, total, api_data = query_lichess(final_fen, args.elo.replace(" ", ""))
-        except Exception as e:
-            logging.debug("API request failed: %s", e)
-            print("API request failed:", e)
-            sys.exit(1)
-        if total > 0:
-            overall_wp = white_wins / total * 100
-            overall_dp = draws / total * 100
-            overall_bp = black_wins / total * 100
-        else:
-            overall_wp = overall_dp = overall_bp = 0
-        print("\nOverall Result from Lichess Explorer:")
-        print(f"Overall: {white_wins}/{draws}/{black_wins} = {total} = "
-              f"{overall_wp:.1f}%/{overall_dp:.1f}%/{overall_bp:.1f}%")
-        logging.debug("Overall API result: %d/%d/%d = %d", white_wins, draws, black_wins, total)
-        moves = api_data.get("moves", [])
-        if moves:
-            # Get current move number and turn from the board.
-            current_move_number = board.fullmove_number
-            is_white_turn = board.turn == chess.WHITE
-            print_moves_table(moves, current_move_number, is_white_turn)
-            logging.debug("Candidate moves table printed.")
-        else:
-            print("No candidate moves available in the API response.")
-            logging.debug("No candidate moves available from API.")
+    # Print game info and the Phase 3 result (Lichess Explorer API or mate).
+    print_results(board.fen(), moves_played_str, board, args.white, args.black, args.elo.replace(" ", ""))
 
 if __name__ == '__main__':
     main()